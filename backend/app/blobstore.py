@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .constants import BLOB_GC_GRACE_S, BLOB_OBJECTS_SUBDIR, BLOB_REFS_NAME, DEFAULT_BLOBS_ROOT
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def check_digest(digest: str) -> str:
+    """Normalize a client-supplied sha256 hex digest; it becomes a path, so be strict."""
+    normalized = digest.strip().lower()
+    if not _DIGEST_RE.match(normalized):
+        raise ValueError(f"Not a sha256 hex digest: {digest!r}")
+    return normalized
+
+
+class BlobStore:
+    """Content-addressed store for raw uploads.
+
+    Blobs live at ``objects/<2 hex>/<sha256>`` and are read-only; job ``raw/`` folders
+    hardlink to them. Each owner (a job or sweep id) holds a reference on the digests
+    linked into its folder, and ``gc`` drops blobs nobody references any more.
+    """
+
+    def __init__(self, root: Path = DEFAULT_BLOBS_ROOT) -> None:
+        self._lock = Lock()
+        self.configure(root)
+
+    def configure(self, root: Path) -> None:
+        with self._lock:
+            self.root = root
+            self._refs: Optional[Dict[str, Set[str]]] = None
+
+    def path(self, digest: str) -> Path:
+        return self.root / BLOB_OBJECTS_SUBDIR / digest[:2] / digest
+
+    def has(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+    def missing(self, digests: Iterable[str]) -> List[str]:
+        absent: List[str] = []
+        for digest in dict.fromkeys(digests):
+            try:
+                # Restart the gc grace period for blobs a client is about to reference
+                os.utime(self.path(digest))
+            except FileNotFoundError:
+                absent.append(digest)
+        return absent
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        target = self.path(digest)
+        if target.exists():
+            os.utime(target)
+            return digest
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f"{digest}.{os.getpid()}.{time.monotonic_ns()}.tmp")
+        tmp.write_bytes(data)
+        # Read-only, so nothing can edit a frame through one job's hardlink
+        tmp.chmod(0o444)
+        os.replace(tmp, target)
+        return digest
+
+    def link(self, digest: str, dest: Path) -> None:
+        source = self.path(digest)
+        try:
+            os.link(source, dest)
+        except OSError:
+            # Different filesystem (or no hardlink support): fall back to a private copy
+            shutil.copyfile(source, dest)
+
+    # -- references -------------------------------------------------------
+
+    def _load_refs(self) -> Dict[str, Set[str]]:
+        if self._refs is None:
+            try:
+                raw = json.loads((self.root / BLOB_REFS_NAME).read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                raw = {}
+            self._refs = {digest: set(owners) for digest, owners in raw.items()}
+        return self._refs
+
+    def _save_refs(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f"{BLOB_REFS_NAME}.tmp"
+        data = {digest: sorted(owners) for digest, owners in sorted(self._load_refs().items()) if owners}
+        tmp.write_text(json.dumps(data, indent=1), encoding="utf-8")
+        tmp.replace(self.root / BLOB_REFS_NAME)
+
+    def owned(self, owner: str) -> Set[str]:
+        with self._lock:
+            return {digest for digest, owners in self._load_refs().items() if owner in owners}
+
+    def refcount(self, digest: str) -> int:
+        with self._lock:
+            return len(self._load_refs().get(digest, ()))
+
+    def add_refs(self, owner: str, digests: Iterable[str]) -> None:
+        with self._lock:
+            refs = self._load_refs()
+            for digest in digests:
+                refs.setdefault(digest, set()).add(owner)
+            self._save_refs()
+
+    def release(self, owner: str) -> None:
+        with self._lock:
+            refs = self._load_refs()
+            for owners in refs.values():
+                owners.discard(owner)
+            self._save_refs()
+
+    def gc(self, grace_s: float = BLOB_GC_GRACE_S) -> Tuple[int, int]:
+        """Delete unreferenced blobs older than ``grace_s``; returns (count, bytes).
+
+        The grace period protects blobs uploaded ahead of the ``/train`` call that
+        will reference them.
+        """
+        removed = reclaimed = 0
+        cutoff = time.time() - grace_s
+        with self._lock:
+            refs = self._load_refs()
+            for blob in (self.root / BLOB_OBJECTS_SUBDIR).glob("*/*"):
+                if blob.name.endswith(".tmp") or refs.get(blob.name):
+                    continue
+                stat = blob.stat()
+                if stat.st_mtime > cutoff:
+                    continue
+                blob.unlink()
+                refs.pop(blob.name, None)
+                removed += 1
+                reclaimed += stat.st_size
+            self._save_refs()
+        return removed, reclaimed
+
+
+blob_store = BlobStore()
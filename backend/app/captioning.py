@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import csv
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .config import CaptionConfig
+from .constants import (
+    CAPTION_TAGGER_ONNX,
+    CAPTION_TAGGER_TEMPLATE,
+    DEFAULT_CAPTION_BATCH_SIZE,
+    DEFAULT_CAPTION_TEMPLATE,
+    DEFAULT_CAPTION_WORKERS,
+)
+
+try:
+    import onnxruntime as ort  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    ort = None  # type: ignore
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Tagger(ABC):
+    """Produces descriptive tags for a batch of images.
+
+    ``cache_key`` identifies the model and settings; taggers returning ``None`` are
+    cheap enough that their output is not cached.
+    """
+
+    name: str = "tagger"
+
+    @property
+    def cache_key(self) -> Optional[str]:
+        return None
+
+    @abstractmethod
+    def tag_batch(self, paths: Sequence[Path]) -> List[List[str]]:
+        ...
+
+
+class TemplateTagger(Tagger):
+    """No extra tags: the caption is just the configured template."""
+
+    name = CAPTION_TAGGER_TEMPLATE
+
+    def tag_batch(self, paths: Sequence[Path]) -> List[List[str]]:
+        return [[] for _ in paths]
+
+
+class OnnxTagger(Tagger):
+    """WD14-style multi-label tagger running on CPU through onnxruntime.
+
+    Expects an NHWC float32 BGR input in the 0–255 range and a ``selected_tags.csv``
+    next to the model (columns ``tag_id,name,category,count``; category 9 are ratings).
+    """
+
+    name = CAPTION_TAGGER_ONNX
+
+    def __init__(self, model_path: Path, tags_path: Path | None, threshold: float, threads: int = 0) -> None:
+        if ort is None:
+            raise RuntimeError("onnxruntime is not installed; use the template tagger or `pip install onnxruntime`")
+        if not model_path.exists():
+            raise FileNotFoundError(f"Tagger model not found: {model_path}")
+        tags_path = tags_path or model_path.with_name("selected_tags.csv")
+        if not tags_path.exists():
+            raise FileNotFoundError(f"Tagger tags file not found: {tags_path}")
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._size = int(model_input.shape[1])
+        # Fixed batch dimension means one image per run
+        self._fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+        with tags_path.open("r", encoding="utf-8") as fh:
+            rows = list(csv.DictReader(fh))
+        self._tags = [row["name"].replace("_", " ") for row in rows]
+        self._skip = np.array([row.get("category") == "9" for row in rows])
+        self._threshold = threshold
+        self._key = f"{self.name}-{file_sha256(model_path)[:16]}-{threshold:g}"
+
+    @property
+    def cache_key(self) -> Optional[str]:
+        return self._key
+
+    def _load(self, path: Path) -> np.ndarray:
+        image = Image.open(path).convert("RGB")
+        w, h = image.size
+        side = max(w, h)
+        square = Image.new("RGB", (side, side), color=(255, 255, 255))
+        square.paste(image, ((side - w) // 2, (side - h) // 2))
+        resized = square.resize((self._size, self._size), Image.BICUBIC)
+        return np.asarray(resized, dtype=np.float32)[:, :, ::-1]
+
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        return self._session.run(None, {self._input_name: batch})[0]
+
+    def tag_batch(self, paths: Sequence[Path]) -> List[List[str]]:
+        if not paths:
+            return []
+        batch = np.stack([self._load(p) for p in paths])
+        if self._fixed_batch == 1:
+            probs = np.concatenate([self._run(batch[i:i + 1]) for i in range(len(batch))])
+        else:
+            probs = self._run(batch)
+        results: List[List[str]] = []
+        for row in probs:
+            picked = np.flatnonzero((row >= self._threshold) & ~self._skip)
+            picked = picked[np.argsort(-row[picked])]
+            results.append([self._tags[i] for i in picked])
+        return results
+
+
+@dataclass
+class Captioner:
+    """Dataset captioning stage: batches images through a tagger in a worker pool."""
+
+    tagger: Tagger = field(default_factory=TemplateTagger)
+    template: str = DEFAULT_CAPTION_TEMPLATE
+    batch_size: int = DEFAULT_CAPTION_BATCH_SIZE
+    workers: int = DEFAULT_CAPTION_WORKERS
+    cache_dir: Optional[Path] = None
+
+    def _cache_path(self, digest: str) -> Optional[Path]:
+        key = self.tagger.cache_key
+        if key is None or self.cache_dir is None:
+            return None
+        return self.cache_dir / key / f"{digest}.txt"
+
+    def _tag_with_cache(self, batch: Sequence[Tuple[Path, Optional[str]]]) -> List[List[str]]:
+        paths = [path for path, _ in batch]
+        cache_paths = [self._cache_path(digest or file_sha256(path)) for path, digest in batch]
+        tags: Dict[int, List[str]] = {}
+        for idx, cache_path in enumerate(cache_paths):
+            if cache_path is not None and cache_path.exists():
+                text = cache_path.read_text(encoding="utf-8")
+                tags[idx] = [t for t in text.split("\n") if t]
+        missing = [idx for idx in range(len(paths)) if idx not in tags]
+        if missing:
+            fresh = self.tagger.tag_batch([paths[idx] for idx in missing])
+            for idx, found in zip(missing, fresh):
+                tags[idx] = found
+                cache_path = cache_paths[idx]
+                if cache_path is not None:
+                    cache_path.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = cache_path.with_suffix(f".{threading.get_ident()}.tmp")
+                    tmp.write_text("\n".join(found), encoding="utf-8")
+                    tmp.replace(cache_path)
+        return [tags[idx] for idx in range(len(paths))]
+
+    def caption(
+        self,
+        paths: Sequence[Path],
+        trigger: str,
+        name: str,
+        digests: Sequence[str] | None = None,
+    ) -> List[str]:
+        """Caption ``paths``; pass known content ``digests`` to skip re-hashing them."""
+        prefix = self.template.format(trigger=trigger, name=name).strip()
+        items = list(zip(paths, digests or [None] * len(paths)))
+        batch_size = max(1, self.batch_size)
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        if isinstance(self.tagger, TemplateTagger):
+            tagged = [[] for _ in paths]
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+                tagged = [tags for chunk in pool.map(self._tag_with_cache, batches) for tags in chunk]
+        return [", ".join([prefix, *tags]) if tags else prefix for tags in tagged]
+
+
+@lru_cache(maxsize=2)
+def _onnx_tagger(model_path: Path, tags_path: Path | None, threshold: float, threads: int) -> OnnxTagger:
+    # Loading the session takes seconds; reuse it across jobs
+    return OnnxTagger(model_path, tags_path, threshold, threads=threads)
+
+
+def build_captioner(cfg: CaptionConfig, tagger_name: str | None = None) -> Captioner:
+    name = (tagger_name or cfg.tagger or CAPTION_TAGGER_TEMPLATE).lower()
+    if name == CAPTION_TAGGER_TEMPLATE:
+        tagger: Tagger = TemplateTagger()
+    elif name == CAPTION_TAGGER_ONNX:
+        if cfg.model_path is None:
+            raise ValueError("caption.model_path must be set to use the onnx tagger")
+        tagger = _onnx_tagger(cfg.model_path, cfg.tags_path, cfg.threshold, cfg.threads)
+    else:
+        raise ValueError(f"Unknown caption tagger '{name}'")
+    return Captioner(
+        tagger=tagger,
+        template=cfg.template,
+        batch_size=cfg.batch_size,
+        workers=cfg.workers,
+        cache_dir=cfg.cache_dir,
+    )
@@ -3,7 +3,7 @@ from __future__ import annotations
 import os
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 import yaml
 
@@ -12,6 +12,14 @@ from .constants import (
     DEFAULT_ACCELERATE_BIN,
     DEFAULT_BASE_MODEL_PATHS,
     DEFAULT_BASE_MODEL_USE,
+    DEFAULT_CAPTION_BATCH_SIZE,
+    DEFAULT_CAPTION_CACHE_DIR,
+    DEFAULT_CAPTION_TAGGER,
+    DEFAULT_CAPTION_TEMPLATE,
+    DEFAULT_CAPTION_THRESHOLD,
+    DEFAULT_CAPTION_WORKERS,
+    DEFAULT_DATASET_EXPORT_DIR,
+    DEFAULT_DATASET_FORMAT,
     DEFAULT_CONFIG_PATH,
     DEFAULT_ED_LORA_DIR,
     DEFAULT_KOHYA_MIXED_PRECISION,
@@ -20,7 +28,10 @@ from .constants import (
     DEFAULT_KOHYA_SCRIPT,
     DEFAULT_KOHYA_WORKDIR,
     DEFAULT_LOCAL_DOCKER,
+    DEFAULT_MAX_CONCURRENT_JOBS,
     DEFAULT_MIN_SNR_GAMMA,
+    DEFAULT_RESOURCE_SAFETY_MARGIN,
+    DEFAULT_SSH_PORT,
     DEFAULT_TRAIN_BATCH_SIZE,
     DEFAULT_TRAIN_CAPTION_DROPOUT,
     DEFAULT_TRAIN_LR_TEXT,
@@ -46,9 +57,21 @@ def _normalize_path(value: Any) -> Path:
 
 @dataclass
 class SSHConfig:
+    # Setting host switches training to the SSH backend; hosts adds more trainer nodes
     host: Optional[str] = None
     user: Optional[str] = None
+    # Remote path, relative to the user's home unless absolute
     workdir: Optional[Path] = None
+    hosts: List[str] = field(default_factory=list)
+    port: int = DEFAULT_SSH_PORT
+    identity_file: Optional[Path] = None
+    ssh_bin: str = "ssh"
+    rsync_bin: str = "rsync"
+    use_cuda: bool = True
+    # Per-node capacity for the batch planner; memory_gb is GPU memory and required with use_cuda,
+    # otherwise None assumes the nodes have the API host's RAM (and cpu_threads 0 its CPUs)
+    memory_gb: Optional[float] = None
+    cpu_threads: int = 0
 
 
 @dataclass
@@ -73,6 +96,47 @@ class TrainConfig:
     mixed_precision: str = DEFAULT_KOHYA_MIXED_PRECISION
 
 
+@dataclass
+class DatasetConfig:
+    image_format: str = DEFAULT_DATASET_FORMAT
+    # Format-specific: PNG compress_level, JPEG quality, WebP method; None picks the format default
+    image_level: Optional[int] = None
+    packed: bool = False
+    export_dir: Path = DEFAULT_DATASET_EXPORT_DIR
+
+
+@dataclass
+class CaptionConfig:
+    tagger: str = DEFAULT_CAPTION_TAGGER
+    template: str = DEFAULT_CAPTION_TEMPLATE
+    batch_size: int = DEFAULT_CAPTION_BATCH_SIZE
+    workers: int = DEFAULT_CAPTION_WORKERS
+    threads: int = 0
+    threshold: float = DEFAULT_CAPTION_THRESHOLD
+    model_path: Optional[Path] = None
+    tags_path: Optional[Path] = None
+    cache_dir: Path = DEFAULT_CAPTION_CACHE_DIR
+
+
+@dataclass
+class ResourceConfig:
+    # Plan the micro-batch from available memory; train_batch_size becomes the effective batch
+    adaptive_batch: bool = True
+    # With adaptive_batch, grow the effective batch up to this when memory allows; 0 keeps train_batch_size
+    max_effective_batch: int = 0
+    safety_margin: float = DEFAULT_RESOURCE_SAFETY_MARGIN
+    # Fail jobs up front when even the smallest batch is estimated not to fit
+    strict_fit: bool = False
+    # Host memory (PSS) cap per trainer; None derives it from RAM and max_concurrent_jobs, 0 disables it
+    memory_limit_gb: Optional[float] = None
+    # Threads per trainer; 0 splits the CPUs evenly across concurrent jobs
+    cpu_threads: int = 0
+    # Pretend capacity, for exercising the planner on CPU-only machines
+    simulate_vram_gb: Optional[float] = None
+    simulate_ram_gb: Optional[float] = None
+    simulate_cpu_threads: int = 0
+
+
 @dataclass
 class KohyaConfig:
     accelerate_bin: str = DEFAULT_ACCELERATE_BIN
@@ -89,8 +153,12 @@ class AppConfig:
     base_model: BaseModelPaths = BaseModelPaths()
     trigger_token: str = DEFAULT_TRIGGER_TOKEN
     local_docker: bool = DEFAULT_LOCAL_DOCKER
+    max_concurrent_jobs: int = DEFAULT_MAX_CONCURRENT_JOBS
     ssh: SSHConfig = SSHConfig()
     train: TrainConfig = TrainConfig()
+    dataset: DatasetConfig = DatasetConfig()
+    caption: CaptionConfig = CaptionConfig()
+    resources: ResourceConfig = ResourceConfig()
     kohya: KohyaConfig = KohyaConfig()
 
     @classmethod
@@ -103,11 +171,20 @@ class AppConfig:
         base_paths = {k: _normalize_path(v) for k, v in base_model.items() if k != "use"}
         base_paths = base_paths or {k: v for k, v in DEFAULT_BASE_MODEL_PATHS.items()}
         train_cfg = TrainConfig(**{**TrainConfig().__dict__, **train})
-        ssh_cfg = SSHConfig(
-            host=ssh.get("host"),
-            user=ssh.get("user"),
-            workdir=_normalize_path(ssh["workdir"]) if ssh.get("workdir") else None,
-        )
+        ssh_cfg = SSHConfig(**{**SSHConfig().__dict__, **ssh})
+        # Remote paths: no local expansion or resolving
+        ssh_cfg.workdir = Path(str(ssh_cfg.workdir)) if ssh_cfg.workdir else None
+        if ssh_cfg.identity_file:
+            ssh_cfg.identity_file = _normalize_path(ssh_cfg.identity_file)
+        dataset_cfg = DatasetConfig(**{**DatasetConfig().__dict__, **data.get("dataset", {})})
+        dataset_cfg.export_dir = _normalize_path(dataset_cfg.export_dir)
+        caption = data.get("caption", {})
+        caption_cfg = CaptionConfig(**{**CaptionConfig().__dict__, **caption})
+        for key in ("model_path", "tags_path", "cache_dir"):
+            value = getattr(caption_cfg, key)
+            if value:
+                setattr(caption_cfg, key, _normalize_path(value))
+        resources_cfg = ResourceConfig(**{**ResourceConfig().__dict__, **data.get("resources", {})})
         kohya_cfg_raw = data.get("kohya", {})
         kohya_cfg = KohyaConfig(
             accelerate_bin=kohya_cfg_raw.get("accelerate_bin", KohyaConfig().accelerate_bin),
@@ -122,8 +199,12 @@ class AppConfig:
             base_model=BaseModelPaths(use=base_use, paths=base_paths),
             trigger_token=data.get("trigger_token", DEFAULT_TRIGGER_TOKEN),
             local_docker=data.get("local_docker", DEFAULT_LOCAL_DOCKER),
+            max_concurrent_jobs=int(data.get("max_concurrent_jobs", DEFAULT_MAX_CONCURRENT_JOBS)),
             ssh=ssh_cfg,
             train=train_cfg,
+            dataset=dataset_cfg,
+            caption=caption_cfg,
+            resources=resources_cfg,
             kohya=kohya_cfg,
         )
 
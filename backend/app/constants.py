@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import tempfile
 from pathlib import Path
 
 
@@ -35,15 +36,52 @@ DEFAULT_CONFIG_PATH = BACKEND_ROOT / CONFIG_FILENAME
 
 DEFAULT_ED_LORA_DIR = (BACKEND_ROOT / "artifacts" / "ed_lora").resolve()
 DEFAULT_JOBS_ROOT = (BACKEND_ROOT / "data" / "jobs").resolve()
+DEFAULT_SWEEPS_ROOT = (BACKEND_ROOT / "data" / "sweeps").resolve()
+DEFAULT_BLOBS_ROOT = (BACKEND_ROOT / "data" / "blobs").resolve()
+DEFAULT_CAPTION_CACHE_DIR = (BACKEND_ROOT / "data" / "cache" / "captions").resolve()
 
 RAW_SUBDIR_NAME = "raw"
 DATASET_SUBDIR_NAME = "dataset"
 CHECKPOINTS_SUBDIR_NAME = "checkpoints"
 DATASET_IMAGES_SUBDIR = "images"
 DATASET_CAPTIONS_SUBDIR = "captions"
+DATASET_MANIFEST_NAME = "manifest.json"
+DATASET_MANIFEST_VERSION = 1
+DATASET_PACKED_SUBDIR = "packed"
+DATASET_LAYOUT_FOLDER = "folder"
+DATASET_LAYOUT_PACKED = "packed"
+PACKED_IMAGES_NAME = "images.u8"
+PACKED_INDEX_NAME = "index.json"
+PACKED_INDEX_VERSION = 1
+
+BLOB_OBJECTS_SUBDIR = "objects"
+BLOB_REFS_NAME = "refs.json"
+# Unreferenced blobs younger than this survive gc (uploaded ahead of their /train call)
+BLOB_GC_GRACE_S = 3600
+
+DATASET_FORMAT_PNG = "png"
+DATASET_FORMAT_WEBP = "webp"
+DATASET_FORMAT_JPEG = "jpeg"
+DATASET_FORMAT_NPY = "npy"
+DEFAULT_DATASET_FORMAT = DATASET_FORMAT_PNG
+# Packed datasets are exported to the kohya layout here, off the (slow) bind-mounted job dir
+DEFAULT_DATASET_EXPORT_DIR = (Path(tempfile.gettempdir()) / "charactertrainer" / "datasets").resolve()
 
 MIN_REFERENCE_IMAGES = 8
 
+EXECUTOR_LOCAL = "local"
+EXECUTOR_SSH = "ssh"
+DEFAULT_SSH_PORT = 22
+# Relative remote paths resolve against the SSH user's home directory
+DEFAULT_REMOTE_WORKDIR = Path("charactertrainer")
+REMOTE_DATASETS_SUBDIR = "datasets"
+REMOTE_JOBS_SUBDIR = "jobs"
+
+DEFAULT_MAX_CONCURRENT_JOBS = 1
+MAX_SWEEP_RUNS = 32
+# Grid keys accepted by /sweeps and how their values are parsed
+SWEEP_PARAM_TYPES = {"network_dim": int, "steps": int, "learning_rate": float}
+
 CONFIG_TEST_MESSAGE = "Environment is ready for training (kohya_ss)"
 
 LOG_PIPELINE_STARTED = "🚀 Starting one-click pipeline…"
@@ -51,11 +89,31 @@ LOG_PIPELINE_MODEL = "Base model: {base}"
 LOG_PIPELINE_FRAME_COUNT = "Frames: {count}"
 LOG_PIPELINE_DATASET = "📦 Preparing images…"
 LOG_PIPELINE_DATASET_DONE = "✅ Dataset prepared"
+LOG_PIPELINE_DATASET_DIFF = "Dataset: {added} encoded, {removed} removed, {recaptioned} re-captioned, {kept} reused"
+LOG_PIPELINE_CAPTIONING = "🏷️ Captioning {count} images ({tagger})…"
+LOG_PIPELINE_QUEUED = "⏳ Waiting for a free training slot (max {limit} at once)…"
+LOG_PIPELINE_SHARED_DATASET = "📦 Using shared dataset {path}"
+LOG_SWEEP_LAUNCH = "🧪 Launching {count} sweep runs"
 LOG_PIPELINE_TRAINING_START = "🚀 Launching kohya_ss…"
+LOG_PIPELINE_RESOURCE_PLAN = (
+    "🧮 Batch {batch} × {accum} accumulation (effective {effective}); "
+    "~{need:.1f} of {budget:.1f} GiB {device}, {threads} CPU threads"
+)
+LOG_PIPELINE_RESOURCE_OVERCOMMIT = (
+    "⚠️ Even batch {batch} is estimated at ~{need:.1f} GiB, over the {budget:.1f} GiB {device} budget; "
+    "trying anyway (set resources.strict_fit to refuse such jobs)"
+)
+LOG_PIPELINE_REMOTE_NODE = "🖥️ Training on {host}"
+LOG_PIPELINE_REMOTE_SYNC = "📡 Dataset synced to {host} ({files} files sent)"
+LOG_PIPELINE_MEMORY_LIMIT = "🛑 Trainer memory {used:.1f} GiB exceeded the {limit:.1f} GiB job limit; stopping"
 LOG_PIPELINE_COPYING = "📁 Copying to {path}"
 LOG_PIPELINE_DONE = "✅ Done! Use weight 0.7–0.85 in Easy Diffusion."
+LOG_PIPELINE_RETRAIN = "🔁 Re-training with updated frames/parameters…"
 LOG_PIPELINE_ERROR = "❌ Error: {error}"
 
+LOG_PUMP_CHUNK_SIZE = 64 * 1024
+LOG_PUMP_MAX_LINE = 16 * 1024
+
 ARTIFACT_TEMPLATE = "{name}_lora_{base}_v1"
 ARTIFACT_SUFFIX = ".safetensors"
 
@@ -83,6 +141,24 @@ DEFAULT_TRAIN_SAVE_EVERY = 500
 DEFAULT_MIN_SNR_GAMMA = 5.0
 DEFAULT_TRAIN_BATCH_SIZE = 1
 
+GIB = 1024**3
+# Share of device memory the planner may hand out; the rest absorbs estimate error
+DEFAULT_RESOURCE_SAFETY_MARGIN = 0.85
+# Memory model for kohya SD1.5 LoRA training (see resources.estimate_memory)
+MEM_BASE_MODEL_PARAMS = 1_070_000_000  # UNet + text encoder + VAE
+MEM_LORA_PARAMS_PER_RANK = 600_000
+MEM_TRAINABLE_BYTES_PER_PARAM = 16  # fp32 weight + grad + two AdamW moments
+MEM_ACTIVATIONS_PER_SAMPLE_512 = 3 * GIB  # half precision, no gradient checkpointing
+MEM_OVERHEAD = 1 * GIB  # CUDA context, allocator slack, data loader buffers
+
+CAPTION_TAGGER_TEMPLATE = "template"
+CAPTION_TAGGER_ONNX = "onnx"
+DEFAULT_CAPTION_TAGGER = CAPTION_TAGGER_TEMPLATE
+DEFAULT_CAPTION_TEMPLATE = "{trigger} {name}"
+DEFAULT_CAPTION_BATCH_SIZE = 8
+DEFAULT_CAPTION_WORKERS = 2
+DEFAULT_CAPTION_THRESHOLD = 0.35
+
 DEFAULT_ACCELERATE_BIN = os.environ.get("ACCELERATE_BIN", "accelerate")
 DEFAULT_KOHYA_ROOT = _default_kohya_root()
 DEFAULT_KOHYA_SCRIPT = DEFAULT_KOHYA_ROOT / "train_network.py"
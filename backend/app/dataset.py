@@ -1,22 +1,242 @@
 from __future__ import annotations
 
+import json
+import shutil
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, Tuple
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 
+import numpy as np
 from PIL import Image
 
+from .captioning import Captioner, file_sha256
 from .constants import (
     DATASET_CAPTIONS_SUBDIR,
+    DATASET_FORMAT_JPEG,
+    DATASET_FORMAT_NPY,
+    DATASET_FORMAT_PNG,
+    DATASET_FORMAT_WEBP,
     DATASET_IMAGES_SUBDIR,
+    DATASET_LAYOUT_FOLDER,
+    DATASET_LAYOUT_PACKED,
+    DATASET_MANIFEST_NAME,
+    DATASET_MANIFEST_VERSION,
+    DATASET_PACKED_SUBDIR,
+    DEFAULT_DATASET_FORMAT,
+    LOG_PIPELINE_CAPTIONING,
     LOG_PIPELINE_DATASET,
+    LOG_PIPELINE_DATASET_DIFF,
     LOG_PIPELINE_DATASET_DONE,
 )
 from .job_manager import job_manager
+from .packed_dataset import PackedItem, open_packed, update_captions, write_packed
 
 
-def _safe_filename(idx: int, original_name: str | None) -> str:
-    suffix = Path(original_name or "image.png").suffix or ".png"
-    return f"{idx:03d}{suffix.lower()}"
+@dataclass(frozen=True)
+class ImageFormat:
+    name: str
+    suffix: str
+    default_level: Optional[int]
+    # Inclusive bounds for ``level``; None when the format ignores it
+    level_range: Optional[Tuple[int, int]] = None
+    # False when kohya_ss cannot load the files directly (raw arrays)
+    kohya_readable: bool = True
+
+    def check_level(self, level: Optional[int]) -> Optional[int]:
+        """``level`` or the format default; Pillow accepts out-of-range values silently, so refuse them here."""
+        if level is None or self.level_range is None:
+            return self.default_level
+        low, high = self.level_range
+        if not low <= level <= high:
+            raise ValueError(f"image_level for {self.name} must be between {low} and {high}, got {level}")
+        return level
+
+    def save(self, image: Image.Image, dest_path: Path, level: Optional[int] = None) -> None:
+        level = self.check_level(level)
+        if self.name == DATASET_FORMAT_PNG:
+            image.save(dest_path, format="PNG", compress_level=level)
+        elif self.name == DATASET_FORMAT_WEBP:
+            image.save(dest_path, format="WEBP", lossless=True, method=level)
+        elif self.name == DATASET_FORMAT_JPEG:
+            image.save(dest_path, format="JPEG", quality=level, subsampling=0)
+        else:
+            with dest_path.open("wb") as fh:
+                np.save(fh, np.asarray(image, dtype=np.uint8))
+
+    def load(self, path: Path) -> np.ndarray:
+        if self.name == DATASET_FORMAT_NPY:
+            return np.load(path)
+        with Image.open(path) as image:
+            return np.asarray(image.convert("RGB"))
+
+
+IMAGE_FORMATS: Dict[str, ImageFormat] = {
+    # PNG compress_level, WebP method, JPEG quality
+    DATASET_FORMAT_PNG: ImageFormat(DATASET_FORMAT_PNG, ".png", default_level=1, level_range=(0, 9)),
+    DATASET_FORMAT_WEBP: ImageFormat(DATASET_FORMAT_WEBP, ".webp", default_level=0, level_range=(0, 6)),
+    DATASET_FORMAT_JPEG: ImageFormat(DATASET_FORMAT_JPEG, ".jpg", default_level=95, level_range=(1, 100)),
+    DATASET_FORMAT_NPY: ImageFormat(DATASET_FORMAT_NPY, ".npy", default_level=None, kohya_readable=False),
+}
+
+
+def get_image_format(name: str, level: Optional[int] = None) -> ImageFormat:
+    """Look up a format, also checking ``level`` against it when one is given."""
+    try:
+        fmt = IMAGE_FORMATS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown dataset image format '{name}'") from None
+    fmt.check_level(level)
+    return fmt
+
+
+def _item_filename(digest: str, fmt: ImageFormat) -> str:
+    return f"{digest[:16]}{fmt.suffix}"
+
+
+def _load_manifest(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != DATASET_MANIFEST_VERSION:
+        return {}
+    return data
+
+
+def _write_manifest(path: Path, manifest: Dict[str, Any]) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+def _resize_square(source: Path, resolution: int) -> Image.Image:
+    image = Image.open(source)
+    image = image.convert("RGB")
+    w, h = image.size
+    side = max(w, h)
+    square = Image.new("RGB", (side, side), color=(0, 0, 0))
+    square.paste(image, ((side - w) // 2, (side - h) // 2))
+    return square.resize((resolution, resolution), Image.LANCZOS)
+
+
+def _remove(entry: Path) -> None:
+    if entry.is_dir():
+        shutil.rmtree(entry)
+    elif entry.exists():
+        entry.unlink()
+
+
+def _sync_folder(
+    images_dir: Path,
+    concept_dir: Path,
+    sources: Dict[str, Tuple[Path, str]],
+    captions: Dict[str, str],
+    old_params: Dict[str, Any],
+    old_items: Dict[str, Dict[str, Any]],
+    resolution: int,
+    fmt: ImageFormat,
+    level: Optional[int],
+) -> Tuple[Dict[str, Dict[str, Any]], int, int]:
+    if (old_params.get("resolution"), old_params.get("format"), old_params.get("level")) != (resolution, fmt.name, level):
+        old_items = {}
+    elif old_params.get("concept_dir") != concept_dir.name:
+        # Renamed character: move the encoded images instead of redoing them
+        old_concept = images_dir / str(old_params.get("concept_dir"))
+        if old_concept.is_dir() and not concept_dir.exists():
+            old_concept.rename(concept_dir)
+        else:
+            old_items = {}
+    concept_dir.mkdir(parents=True, exist_ok=True)
+
+    items: Dict[str, Dict[str, Any]] = {}
+    added = recaptioned = 0
+    for digest, (path, source_name) in sources.items():
+        previous = old_items.get(digest)
+        dest_name = _item_filename(digest, fmt)
+        if previous is None or previous.get("file") != dest_name or not (concept_dir / dest_name).exists():
+            fmt.save(_resize_square(path, resolution), concept_dir / dest_name, level)
+            previous = None
+            added += 1
+        caption = captions[digest]
+        # caption sidecar goes next to the image as expected by kohya_ss
+        caption_path = concept_dir / f"{Path(dest_name).stem}.txt"
+        if previous is None or previous.get("caption") != caption or not caption_path.exists():
+            caption_path.write_text(caption, encoding="utf-8")
+            if previous is not None:
+                recaptioned += 1
+        items[digest] = {"source": source_name, "file": dest_name, "caption": caption}
+
+    # Drop anything kohya would otherwise pick up: removed items and stale concept folders
+    expected = {fname for item in items.values() for fname in (item["file"], f"{Path(item['file']).stem}.txt")}
+    stale = [entry for entry in concept_dir.iterdir() if entry.name not in expected]
+    stale += [entry for entry in images_dir.iterdir() if entry != concept_dir]
+    for entry in stale:
+        _remove(entry)
+    return items, added, recaptioned
+
+
+def _sync_packed(
+    packed_dir: Path,
+    sources: Dict[str, Tuple[Path, str]],
+    captions: Dict[str, str],
+    old_params: Dict[str, Any],
+    resolution: int,
+) -> Tuple[Dict[str, Dict[str, Any]], int, int]:
+    old_pack = open_packed(packed_dir) if old_params.get("resolution") == resolution else None
+    old_entries = old_pack.items if old_pack else []
+    old_rows = {entry["digest"]: row for row, entry in enumerate(old_entries)}
+    added = sum(1 for digest in sources if digest not in old_rows)
+    recaptioned = sum(
+        1 for digest in sources if digest in old_rows and old_entries[old_rows[digest]]["caption"] != captions[digest]
+    )
+
+    if old_pack is not None and list(sources) == [entry["digest"] for entry in old_entries]:
+        # Same images in the same order: only the index needs touching
+        if recaptioned:
+            update_captions(packed_dir, captions)
+        old_pack.close()
+    else:
+        def rows() -> Iterator[PackedItem]:
+            for digest, (path, source_name) in sources.items():
+                if digest in old_rows:
+                    image = old_pack[old_rows[digest]]
+                else:
+                    image = np.asarray(_resize_square(path, resolution), dtype=np.uint8)
+                yield digest, image, captions[digest], source_name
+
+        write_packed(packed_dir, resolution, rows(), count=len(sources))
+        if old_pack is not None:
+            old_pack.close()
+
+    items = {
+        digest: {"source": source_name, "row": row, "caption": captions[digest]}
+        for row, (digest, (_, source_name)) in enumerate(sources.items())
+    }
+    return items, added, recaptioned
+
+
+def export_kohya_layout(
+    packed_dir: Path,
+    dataset_dir: Path,
+    concept_name: str,
+    image_format: str = DEFAULT_DATASET_FORMAT,
+    image_level: Optional[int] = None,
+) -> Path:
+    """Materialize a packed dataset as the kohya_ss folder layout under ``dataset_dir``."""
+    fmt = get_image_format(image_format, image_level)
+    pack = open_packed(packed_dir)
+    if pack is None:
+        raise FileNotFoundError(f"Packed dataset not found: {packed_dir}")
+    concept_dir = dataset_dir / DATASET_IMAGES_SUBDIR / f"1_{concept_name}"
+    concept_dir.mkdir(parents=True, exist_ok=True)
+    for idx, entry in enumerate(pack.items):
+        dest_name = _item_filename(entry["digest"], fmt)
+        fmt.save(Image.fromarray(np.asarray(pack[idx]), "RGB"), concept_dir / dest_name, image_level)
+        (concept_dir / f"{Path(dest_name).stem}.txt").write_text(entry["caption"], encoding="utf-8")
+    pack.close()
+    return dataset_dir
 
 
 def prepare_dataset(
@@ -26,30 +246,69 @@ def prepare_dataset(
     resolution: int,
     trigger: str,
     name: str,
+    captioner: Captioner | None = None,
+    image_format: str = DEFAULT_DATASET_FORMAT,
+    image_level: Optional[int] = None,
+    packed: bool = False,
 ) -> None:
+    """Bring ``dataset_dir`` in line with ``raw_files``, re-encoding only what changed.
+
+    ``manifest.json`` maps each source content hash to its prepared file and caption.
+    Unchanged items are kept, removed ones deleted, and a caption-only change
+    (e.g. a new trigger) rewrites sidecars without touching the images. The chosen
+    ``image_format``/``image_level`` are recorded there too; changing them re-encodes.
+
+    With ``packed`` the images go into a single memory-mapped file under ``packed/``
+    instead of one file per image; see :func:`export_kohya_layout`.
+    """
+    fmt = get_image_format(image_format)
+    level = fmt.check_level(image_level)
     images_dir = dataset_dir / DATASET_IMAGES_SUBDIR
+    packed_dir = dataset_dir / DATASET_PACKED_SUBDIR
     # kohya_ss expects train_data_dir to be the parent of folders with images
     # Create one concept folder and place images and captions inside it
     concept_name = name.strip() or "concept"
     # DreamBooth expects subfolder names like "<repeats>_<concept>"
     concept_dir = images_dir / f"1_{concept_name}"
-    concept_dir.mkdir(parents=True, exist_ok=True)
 
     job_manager.append_log(job_id, LOG_PIPELINE_DATASET)
 
-    for idx, (path, original_name) in enumerate(raw_files):
-        dest_name = _safe_filename(idx, original_name)
-        dest_path = concept_dir / dest_name
-        image = Image.open(path)
-        image = image.convert("RGB")
-        w, h = image.size
-        side = max(w, h)
-        square = Image.new("RGB", (side, side), color=(0, 0, 0))
-        square.paste(image, ((side - w) // 2, (side - h) // 2))
-        resized = square.resize((resolution, resolution), Image.LANCZOS)
-        resized.save(dest_path, format="PNG")
-        # write caption sidecar next to image as expected by kohya_ss
-        caption_path = concept_dir / f"{dest_path.stem}.txt"
-        caption_path.write_text(f"{trigger} {name}", encoding="utf-8")
+    manifest_path = dataset_dir / DATASET_MANIFEST_NAME
+    manifest = _load_manifest(manifest_path)
+    layout = DATASET_LAYOUT_PACKED if packed else DATASET_LAYOUT_FOLDER
+    if packed:
+        params: Dict[str, Any] = {"resolution": resolution, "layout": layout}
+    else:
+        params = {"resolution": resolution, "layout": layout, "concept_dir": concept_dir.name, "format": fmt.name, "level": level}
+    old_params = manifest.get("params", {})
+    old_items: Dict[str, Dict[str, Any]] = manifest.get("items", {})
+    if old_params.get("layout", DATASET_LAYOUT_FOLDER) != layout:
+        old_items = {}
+
+    # Identical uploads collapse into a single item
+    sources: Dict[str, Tuple[Path, str]] = {}
+    for path, original_name in raw_files:
+        sources.setdefault(file_sha256(path), (path, original_name or path.name))
+
+    captioner = captioner or Captioner()
+    digests = list(sources)
+    job_manager.append_log(job_id, LOG_PIPELINE_CAPTIONING.format(count=len(digests), tagger=captioner.tagger.name))
+    captions = dict(zip(digests, captioner.caption([sources[d][0] for d in digests], trigger, name, digests=digests)))
+
+    if packed:
+        _remove(images_dir)
+        items, added, recaptioned = _sync_packed(packed_dir, sources, captions, old_params, resolution)
+    else:
+        _remove(packed_dir)
+        items, added, recaptioned = _sync_folder(
+            images_dir, concept_dir, sources, captions, old_params, old_items, resolution, fmt, level
+        )
 
+    removed = len(set(old_items) - set(items))
+    kept = len(items) - added
+    _write_manifest(manifest_path, {"version": DATASET_MANIFEST_VERSION, "params": params, "items": items})
+    job_manager.append_log(
+        job_id,
+        LOG_PIPELINE_DATASET_DIFF.format(added=added, removed=removed, recaptioned=recaptioned, kept=kept),
+    )
     job_manager.append_log(job_id, LOG_PIPELINE_DATASET_DONE)
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import re
+import shlex
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .config import AppConfig
+from .constants import (
+    DEFAULT_REMOTE_WORKDIR,
+    EXECUTOR_LOCAL,
+    EXECUTOR_SSH,
+    GIB,
+    LOG_PIPELINE_REMOTE_NODE,
+    LOG_PIPELINE_REMOTE_SYNC,
+    REMOTE_DATASETS_SUBDIR,
+    REMOTE_JOBS_SUBDIR,
+)
+from .job_manager import job_manager
+from .resources import ResourceCapacity, detect_capacity, detect_ram
+
+try:
+    import torch  # type: ignore
+except Exception:  # pragma: no cover
+    torch = None  # type: ignore
+
+_RSYNC_SENT_RE = re.compile(r"Number of regular files transferred:\s*([\d,]+)")
+
+
+def _dataset_key(dataset_dir: Path) -> str:
+    return hashlib.sha1(str(dataset_dir.resolve()).encode("utf-8")).hexdigest()[:16]
+
+
+class ExecutionBackend(ABC):
+    """Where kohya_ss runs: stages the dataset, launches the trainer, brings outputs back."""
+
+    name = ""
+    # The trainer is a local process tree (the memory watchdog can measure it)
+    local = True
+
+    def __init__(self, config: AppConfig) -> None:
+        self.config = config
+
+    @property
+    def nodes(self) -> int:
+        return 1
+
+    @abstractmethod
+    def use_cuda(self) -> bool:
+        ...
+
+    @abstractmethod
+    def capacity(self) -> ResourceCapacity:
+        ...
+
+    @abstractmethod
+    async def check_paths(self, job_id: str, paths: Mapping[str, Path]) -> None:
+        """Raise ``FileNotFoundError`` for the first of ``{description: path}`` the trainer cannot see."""
+
+    @abstractmethod
+    async def stage(
+        self, job_id: str, dataset_dir: Path, output_dir: Path, source_dir: Optional[Path] = None
+    ) -> Tuple[Path, Path]:
+        """Make the dataset available to the trainer; returns its (dataset, output) paths.
+
+        ``source_dir`` is the prepared dataset ``dataset_dir`` was exported from, if any.
+        """
+
+    @abstractmethod
+    async def launch(
+        self, job_id: str, command: Sequence[str], cwd: Path, env: Mapping[str, str]
+    ) -> asyncio.subprocess.Process:
+        """Start ``command``; the returned process streams the trainer's combined output on stdout."""
+
+    async def collect(self, job_id: str, trainer_output: Path, output_dir: Path) -> None:
+        """Copy the trainer's outputs into the local ``output_dir``."""
+
+    async def release(self, job_id: str) -> None:
+        """Called once per run, whatever happened."""
+
+    async def forget_dataset(self, dataset_dir: Path) -> None:
+        """Drop any copies staged from ``dataset_dir``; called before the local dataset is deleted."""
+
+
+class LocalBackend(ExecutionBackend):
+    name = EXECUTOR_LOCAL
+
+    def use_cuda(self) -> bool:
+        try:
+            return torch is not None and bool(torch.cuda.is_available())
+        except Exception:
+            return False
+
+    def capacity(self) -> ResourceCapacity:
+        return detect_capacity(self.config.resources)
+
+    async def check_paths(self, job_id: str, paths: Mapping[str, Path]) -> None:
+        for description, path in paths.items():
+            if not path.exists():
+                raise FileNotFoundError(f"{description} not found: {path}")
+
+    async def stage(
+        self, job_id: str, dataset_dir: Path, output_dir: Path, source_dir: Optional[Path] = None
+    ) -> Tuple[Path, Path]:
+        return dataset_dir, output_dir
+
+    async def launch(
+        self, job_id: str, command: Sequence[str], cwd: Path, env: Mapping[str, str]
+    ) -> asyncio.subprocess.Process:
+        return await asyncio.create_subprocess_exec(
+            *command,
+            cwd=str(cwd),
+            env={**os.environ, **env},
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            # Own process group, so the watchdog can stop accelerate and its workers together
+            start_new_session=True,
+        )
+
+
+class SSHBackend(ExecutionBackend):
+    """Runs kohya_ss on trainer nodes over SSH.
+
+    Nodes need kohya_ss and the base models at the configured paths. Datasets are
+    rsynced into ``<workdir>/datasets`` and kept there, so re-runs only send changes;
+    per-job outputs under ``<workdir>/jobs`` are fetched and removed after training.
+    A relative workdir is resolved against each node's login directory.
+    """
+
+    name = EXECUTOR_SSH
+    local = False
+
+    def __init__(self, config: AppConfig) -> None:
+        super().__init__(config)
+        ssh = config.ssh
+        self.hosts: List[str] = [ssh.host, *[h for h in ssh.hosts if h != ssh.host]]
+        self.workdir = ssh.workdir or DEFAULT_REMOTE_WORKDIR
+        self._active: Dict[str, int] = {host: 0 for host in self.hosts}
+        self._assigned: Dict[str, str] = {}
+        self._previous: Dict[str, str] = {}
+        self._sync_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._workdirs: Dict[str, Path] = {}
+
+    @property
+    def nodes(self) -> int:
+        return len(self.hosts)
+
+    def use_cuda(self) -> bool:
+        return self.config.ssh.use_cuda
+
+    def capacity(self) -> ResourceCapacity:
+        ssh = self.config.ssh
+        # The device comes from the node config: the API host's GPU (or lack of one) says nothing
+        if ssh.memory_gb is not None:
+            memory = int(ssh.memory_gb * GIB)
+        elif ssh.use_cuda:
+            raise RuntimeError("Set ssh.memory_gb to the trainer nodes' GPU memory for the batch planner")
+        else:
+            memory = detect_ram(self.config.resources)
+        return ResourceCapacity(
+            "cuda" if ssh.use_cuda else "cpu",
+            memory,
+            ssh.cpu_threads or detect_capacity(self.config.resources).cpu_threads,
+        )
+
+    def _node(self, job_id: str) -> str:
+        host = self._assigned.get(job_id)
+        if host is None:
+            # Least busy node; a re-run prefers its last node, which already has the dataset
+            previous = self._previous.get(job_id)
+            host = min(self.hosts, key=lambda h: (self._active[h], h != previous))
+            self._assigned[job_id] = self._previous[job_id] = host
+            self._active[host] += 1
+            job_manager.append_log(job_id, LOG_PIPELINE_REMOTE_NODE.format(host=host))
+        return host
+
+    def _ssh_options(self) -> List[str]:
+        ssh = self.config.ssh
+        options = [ssh.ssh_bin, "-o", "BatchMode=yes", "-p", str(ssh.port)]
+        if ssh.identity_file:
+            options += ["-i", str(ssh.identity_file)]
+        return options
+
+    def _target(self, host: str) -> str:
+        return f"{self.config.ssh.user}@{host}" if self.config.ssh.user else host
+
+    async def _run(self, *args: str) -> str:
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            detail = stderr.decode("utf-8", errors="replace").strip().splitlines()[-1:] or [""]
+            raise RuntimeError(f"{Path(args[0]).name} exited with code {process.returncode}: {detail[0]}")
+        return stdout.decode("utf-8", errors="replace")
+
+    async def _remote(self, host: str, script: str) -> str:
+        return await self._run(*self._ssh_options(), self._target(host), script)
+
+    async def _rsync(self, source: str, destination: str, delete: bool = False, checksum: bool = False) -> str:
+        shell = shlex.join(self._ssh_options())
+        flags = ["-a", "--stats", *(["--delete"] if delete else []), *(["--checksum"] if checksum else [])]
+        return await self._run(self.config.ssh.rsync_bin, *flags, "-e", shell, source, destination)
+
+    async def _workdir(self, host: str) -> Path:
+        """Absolute workdir on ``host``: kohya runs from its own folder, so relative paths would break."""
+        if host not in self._workdirs:
+            quoted = shlex.quote(str(self.workdir))
+            resolved = (await self._remote(host, f"mkdir -p {quoted} && cd {quoted} && pwd")).strip().splitlines()
+            if not resolved:
+                raise RuntimeError(f"Could not resolve {self.workdir} on {host}")
+            self._workdirs[host] = Path(resolved[-1])
+        return self._workdirs[host]
+
+    async def check_paths(self, job_id: str, paths: Mapping[str, Path]) -> None:
+        host = self._node(job_id)
+        quoted = " ".join(shlex.quote(str(path)) for path in paths.values())
+        missing = (await self._remote(host, f'for p in {quoted}; do [ -e "$p" ] || echo "$p"; done')).split("\n")
+        for description, path in paths.items():
+            if str(path) in missing:
+                raise FileNotFoundError(f"{description} not found on {host}: {path}")
+
+    async def stage(
+        self, job_id: str, dataset_dir: Path, output_dir: Path, source_dir: Optional[Path] = None
+    ) -> Tuple[Path, Path]:
+        host = self._node(job_id)
+        # Keyed by the prepared dataset, not a per-run export, so sweep runs and re-runs share one remote copy
+        key = _dataset_key(source_dir or dataset_dir)
+        workdir = await self._workdir(host)
+        remote_dataset = workdir / REMOTE_DATASETS_SUBDIR / key
+        remote_output = workdir / REMOTE_JOBS_SUBDIR / job_id / output_dir.name
+        await self._remote(host, f"mkdir -p {shlex.quote(str(remote_dataset))} {shlex.quote(str(remote_output))}")
+        async with self._sync_locks.setdefault((host, key), asyncio.Lock()):
+            # A fresh export has new mtimes, so compare contents to keep the transfer to real changes
+            stats = await self._rsync(
+                f"{dataset_dir}/",
+                f"{self._target(host)}:{remote_dataset}/",
+                delete=True,
+                checksum=source_dir is not None and source_dir != dataset_dir,
+            )
+        sent = _RSYNC_SENT_RE.search(stats)
+        job_manager.append_log(
+            job_id, LOG_PIPELINE_REMOTE_SYNC.format(host=host, files=sent.group(1) if sent else "?")
+        )
+        return remote_dataset, remote_output
+
+    async def launch(
+        self, job_id: str, command: Sequence[str], cwd: Path, env: Mapping[str, str]
+    ) -> asyncio.subprocess.Process:
+        host = self._node(job_id)
+        exports = " ".join(f"{key}={shlex.quote(value)}" for key, value in env.items())
+        script = f"cd {shlex.quote(str(cwd))} && exec env {exports} {shlex.join(command)} 2>&1"
+        # Killing the ssh client ends the trainer at its next write (SIGPIPE)
+        return await asyncio.create_subprocess_exec(
+            *self._ssh_options(),
+            self._target(host),
+            script,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+
+    async def collect(self, job_id: str, trainer_output: Path, output_dir: Path) -> None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        await self._rsync(f"{self._target(self._node(job_id))}:{trainer_output}/", f"{output_dir}/")
+
+    async def release(self, job_id: str) -> None:
+        host = self._assigned.pop(job_id, None)
+        if host is None:
+            return
+        self._active[host] -= 1
+        workdir = self._workdirs.get(host)
+        if workdir is None:
+            return  # nothing was staged on this node
+        try:
+            await self._remote(host, f"rm -rf {shlex.quote(str(workdir / REMOTE_JOBS_SUBDIR / job_id))}")
+        except (OSError, RuntimeError):
+            pass  # best effort; a leftover output folder is harmless
+
+    async def forget_dataset(self, dataset_dir: Path) -> None:
+        key = _dataset_key(dataset_dir)
+        for host in self.hosts:
+            try:
+                workdir = await self._workdir(host)
+                await self._remote(host, f"rm -rf {shlex.quote(str(workdir / REMOTE_DATASETS_SUBDIR / key))}")
+            except (OSError, RuntimeError):
+                pass  # best effort; an unreachable node keeps its copy
+
+
+_backend: Optional[ExecutionBackend] = None
+
+
+def configure_backend(config: AppConfig) -> ExecutionBackend:
+    """SSH when ``ssh.host`` is configured, otherwise the API host itself."""
+    global _backend
+    _backend = SSHBackend(config) if config.ssh.host else LocalBackend(config)
+    return _backend
+
+
+def get_backend(config: AppConfig) -> ExecutionBackend:
+    return _backend or configure_backend(config)
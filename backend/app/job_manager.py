@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import enum
+import time
 from dataclasses import dataclass, field
 from threading import Lock
 from typing import Dict, List, Optional
@@ -8,6 +9,7 @@ from typing import Dict, List, Optional
 
 class JobState(str, enum.Enum):
     PREPPING = "prepping"
+    QUEUED = "queued"
     TRAINING = "training"
     COPYING = "copying"
     DONE = "done"
@@ -21,6 +23,10 @@ class JobRecord:
     logs: List[str] = field(default_factory=list)
     artifact_path: Optional[str] = None
     error: Optional[str] = None
+    progress: Optional[str] = None
+    metrics: Dict[str, float] = field(default_factory=dict)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
     params: Dict[str, str] = field(default_factory=dict)
 
 
@@ -42,12 +48,33 @@ class JobManager:
         with self._lock:
             job = self._jobs[job_id]
             job.state = state
+            if state == JobState.TRAINING and job.started_at is None:
+                job.started_at = time.time()
+            elif state == JobState.DONE:
+                job.finished_at = time.time()
+
+    def set_metric(self, job_id: str, key: str, value: float) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            job.metrics[key] = value
 
     def append_log(self, job_id: str, message: str) -> None:
         with self._lock:
             job = self._jobs[job_id]
             job.logs.append(message)
 
+    def append_logs(self, job_id: str, messages: List[str]) -> None:
+        if not messages:
+            return
+        with self._lock:
+            job = self._jobs[job_id]
+            job.logs.extend(messages)
+
+    def set_progress(self, job_id: str, progress: Optional[str]) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            job.progress = progress
+
     def set_artifact(self, job_id: str, path: str) -> None:
         with self._lock:
             job = self._jobs[job_id]
@@ -58,8 +85,26 @@ class JobManager:
             job = self._jobs[job_id]
             job.error = message
             job.state = JobState.ERROR
+            job.finished_at = time.time()
+
+    def restart(self, job_id: str, params: Dict[str, str]) -> JobRecord:
+        with self._lock:
+            job = self._jobs[job_id]
+            job.params.update(params)
+            job.state = JobState.PREPPING
+            job.error = None
+            job.artifact_path = None
+            job.progress = None
+            job.metrics = {}
+            job.started_at = None
+            job.finished_at = None
+            return job
+
+    def remove(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
 
-    def to_dict(self, job_id: str) -> Dict[str, Optional[str]]:
+    def to_dict(self, job_id: str) -> Dict[str, object]:
         job = self.get(job_id)
         if not job:
             raise KeyError(job_id)
@@ -67,6 +112,8 @@ class JobManager:
             "job_id": job.job_id,
             "state": job.state.value,
             "logs": job.logs,
+            "progress": job.progress,
+            "metrics": job.metrics,
             "artifact_path": job.artifact_path,
             "error": job.error,
         }
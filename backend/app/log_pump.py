@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+import re
+from typing import Callable, List, Optional, Tuple
+
+from .constants import LOG_PUMP_CHUNK_SIZE, LOG_PUMP_MAX_LINE
+from .job_manager import job_manager
+
+# tqdm bars as printed by kohya_ss, e.g.
+# "steps:  10%|█         | 250/2500 [01:23<12:34,  2.98it/s, avr_loss=0.0912]"
+_PROGRESS_RE = re.compile(r"\d+%\|[^|]*\|\s*\d+/\d+")
+
+
+def is_progress_line(text: str) -> bool:
+    return _PROGRESS_RE.search(text) is not None
+
+
+def _visible_segment(line: str) -> str:
+    # Like a terminal: of several "\r"-separated rewrites only the last one stays visible
+    line = line.rstrip()
+    return line[line.rfind("\r") + 1:]
+
+
+class LogPump:
+    """Split raw process output into log lines, collapsing progress-bar refreshes.
+
+    Lines end at "\n"; within a line only the last "\r" rewrite is kept. Consecutive
+    progress lines only update the latest progress value; the last one of a run is
+    committed to the log once a regular line (or EOF) ends the run.
+    """
+
+    def __init__(self, max_line: int = LOG_PUMP_MAX_LINE) -> None:
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self._buffer = ""
+        self._max_line = max_line
+        self.progress: Optional[str] = None
+
+    def feed(self, data: bytes) -> Tuple[List[str], Optional[str]]:
+        """Consume a chunk and return (committed lines, latest progress or None)."""
+        self._buffer += self._decoder.decode(data)
+        lines = self._buffer.split("\n")
+        self._buffer = lines.pop()
+        parts = [_visible_segment(line) for line in lines]
+        if "\r" in self._buffer:
+            # A finished "\r" rewrite is complete even before its line ends
+            done, self._buffer = self._buffer.rsplit("\r", 1)
+            parts.append(_visible_segment(done))
+        if len(self._buffer) > self._max_line:
+            parts.append(self._buffer)
+            self._buffer = ""
+        return self._consume(parts)
+
+    def close(self) -> Tuple[List[str], Optional[str]]:
+        """Flush the trailing partial line and any pending progress."""
+        parts = [_visible_segment(self._buffer + self._decoder.decode(b"", final=True))]
+        self._buffer = ""
+        lines, progress = self._consume(parts)
+        if self.progress is not None:
+            lines.append(self.progress)
+            self.progress = None
+        return lines, progress
+
+    def _consume(self, parts: List[str]) -> Tuple[List[str], Optional[str]]:
+        lines: List[str] = []
+        updated: Optional[str] = None
+        for part in parts:
+            text = part.rstrip()
+            if not text:
+                continue
+            if is_progress_line(text):
+                self.progress = text
+                updated = text
+                continue
+            if self.progress is not None:
+                lines.append(self.progress)
+                self.progress = None
+            lines.append(text)
+        return lines, updated
+
+
+async def pump_stream(
+    reader: asyncio.StreamReader,
+    job_id: str,
+    on_line: Callable[[str], None] | None = None,
+    chunk_size: int = LOG_PUMP_CHUNK_SIZE,
+) -> None:
+    """Drain ``reader`` into the job log in chunk-sized batches."""
+    pump = LogPump()
+    while True:
+        chunk = await reader.read(chunk_size)
+        if chunk:
+            lines, progress = pump.feed(chunk)
+        else:
+            lines, progress = pump.close()
+        if progress is not None:
+            job_manager.set_progress(job_id, progress)
+        job_manager.append_logs(job_id, lines)
+        if on_line:
+            for text in lines:
+                try:
+                    on_line(text)
+                except Exception:
+                    pass
+        if not chunk:
+            break
@@ -1,27 +1,37 @@
 from __future__ import annotations
 
 import asyncio
+import json
+import shutil
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional, Tuple
 from uuid import uuid4
 
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
+from .blobstore import blob_store, check_digest
 from .config import AppConfig, load_config
 from .constants import (
     API_TITLE,
     API_VERSION,
     CONFIG_TEST_MESSAGE,
+    DATASET_SUBDIR_NAME,
     DEFAULT_JOBS_ROOT,
+    DEFAULT_SWEEPS_ROOT,
     LOG_PIPELINE_FRAME_COUNT,
     LOG_PIPELINE_MODEL,
+    LOG_PIPELINE_RETRAIN,
     LOG_PIPELINE_STARTED,
     MIN_REFERENCE_IMAGES,
     RAW_SUBDIR_NAME,
 )
-from .job_manager import job_manager
+from .executors import configure_backend
+from .job_manager import JobState, job_manager
+from .resources import plan_job
+from .scheduler import scheduler
+from .sweeps import SweepRecord, expand_grid, run_sweep, sweep_manager
 from .training import bootstrap_job, run_pipeline
 from .diagnostics import gpu_diagnostics
 
@@ -36,8 +46,14 @@ app.add_middleware(
 
 config: AppConfig = load_config()
 
+backend = configure_backend(config)
+# max_concurrent_jobs applies per trainer node
+scheduler.configure(config.max_concurrent_jobs * backend.nodes)
+
 JOBS_ROOT = DEFAULT_JOBS_ROOT
 JOBS_ROOT.mkdir(parents=True, exist_ok=True)
+SWEEPS_ROOT = DEFAULT_SWEEPS_ROOT
+SWEEPS_ROOT.mkdir(parents=True, exist_ok=True)
 
 # Serve artifacts statically for easy access from UI
 ARTIFACTS_DIR = (Path(__file__).resolve().parents[1] / "artifacts").resolve()
@@ -45,6 +61,60 @@ ARTIFACTS_DIR.mkdir(parents=True, exist_ok=True)
 app.mount("/artifacts", StaticFiles(directory=str(ARTIFACTS_DIR), html=True), name="artifacts")
 
 
+def _parse_blob_refs(raw: Optional[str]) -> List[Tuple[str, str]]:
+    """Parse the ``blobs`` form field: a JSON list of digests or ``{"sha256", "filename"}`` objects."""
+    if not raw:
+        return []
+    refs: List[Tuple[str, str]] = []
+    try:
+        items = json.loads(raw)
+        if not isinstance(items, list):
+            raise ValueError("blobs must be a JSON list")
+        for item in items:
+            if isinstance(item, str):
+                refs.append((check_digest(item), ""))
+            elif isinstance(item, dict):
+                refs.append((check_digest(str(item.get("sha256", ""))), str(item.get("filename") or "")))
+            else:
+                raise ValueError("blobs entries must be digests or objects")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from None
+    missing = blob_store.missing(digest for digest, _ in refs)
+    if missing:
+        # The client uploads these through /blobs and retries
+        raise HTTPException(status_code=400, detail={"message": "Unknown blobs", "missing": missing})
+    return refs
+
+
+async def _store_uploads(
+    files: List[UploadFile],
+    raw_dir: Path,
+    owner: str,
+    blobs: Iterable[Tuple[str, str]] = (),
+    offset: int = 0,
+) -> List[Path]:
+    """Put uploads in the blob store and hardlink every new frame into ``raw_dir``.
+
+    Frames ``owner`` already references (e.g. re-submitted on retrain) are skipped.
+    """
+    entries: List[Tuple[str, str]] = []
+    for file in files:
+        entries.append((blob_store.put(await file.read()), file.filename or ""))
+    entries.extend(blobs)
+
+    owned = blob_store.owned(owner)
+    stored_files: List[Path] = []
+    for digest, filename in entries:
+        if digest in owned:
+            continue
+        owned.add(digest)
+        file_path = raw_dir / f"{offset + len(stored_files):03d}_{Path(filename).name or digest[:16]}"
+        blob_store.link(digest, file_path)
+        stored_files.append(file_path)
+    blob_store.add_refs(owner, owned)
+    return stored_files
+
+
 @app.post("/config/test")
 async def config_test() -> Dict[str, object]:
     return {
@@ -52,6 +122,8 @@ async def config_test() -> Dict[str, object]:
         "ed_lora_dir": str(config.ed_lora_dir),
         "docker": config.local_docker,
         "ssh": bool(config.ssh.host),
+        "backend": backend.name,
+        "nodes": backend.nodes,
         "message": CONFIG_TEST_MESSAGE,
     }
 
@@ -65,11 +137,14 @@ async def start_training(
     network_dim: int = Form(...),
     steps: int = Form(...),
     unet_only: str = Form(...),
-    files: List[UploadFile] = File(...),
+    files: List[UploadFile] = File([]),
+    blobs: Optional[str] = Form(None),
+    tagger: Optional[str] = Form(None),
 ) -> Dict[str, str]:
     if not name.strip():
         raise HTTPException(status_code=400, detail="Character name is required")
-    if len(files) < MIN_REFERENCE_IMAGES:
+    blob_refs = _parse_blob_refs(blobs)
+    if len(files) + len(blob_refs) < MIN_REFERENCE_IMAGES:
         raise HTTPException(status_code=400, detail="At least 8 images required")
 
     job_id = str(uuid4())
@@ -77,12 +152,7 @@ async def start_training(
     raw_dir = job_dir / RAW_SUBDIR_NAME
     raw_dir.mkdir(parents=True, exist_ok=True)
 
-    stored_files: List[Path] = []
-    for idx, file in enumerate(files):
-        content = await file.read()
-        file_path = raw_dir / f"{idx:03d}_{file.filename or 'image' }"
-        file_path.write_bytes(content)
-        stored_files.append(file_path)
+    stored_files = await _store_uploads(files, raw_dir, job_id, blob_refs)
 
     params: Dict[str, str] = {
         "job_id": job_id,
@@ -94,6 +164,8 @@ async def start_training(
         "steps": str(steps),
         "unet_only": str(unet_only),
     }
+    if tagger:
+        params["tagger"] = tagger.strip()
 
     job = bootstrap_job(raw_dir, params)
     job_manager.append_log(job.job_id, LOG_PIPELINE_STARTED)
@@ -104,6 +176,90 @@ async def start_training(
     return {"job_id": job.job_id}
 
 
+@app.post("/jobs/{job_id}/retrain")
+async def retrain(
+    job_id: str,
+    name: Optional[str] = Form(None),
+    trigger: Optional[str] = Form(None),
+    base_model: Optional[str] = Form(None),
+    resolution: Optional[int] = Form(None),
+    network_dim: Optional[int] = Form(None),
+    steps: Optional[int] = Form(None),
+    unet_only: Optional[str] = Form(None),
+    tagger: Optional[str] = Form(None),
+    files: List[UploadFile] = File([]),
+    blobs: Optional[str] = Form(None),
+) -> Dict[str, str]:
+    """Re-run a finished job in place; the dataset is updated incrementally."""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.params.get("sweep_id"):
+        raise HTTPException(status_code=409, detail="Sweep jobs are managed through /sweeps")
+    if job.state not in (JobState.DONE, JobState.ERROR):
+        raise HTTPException(status_code=409, detail="Job is still running")
+
+    raw_dir = JOBS_ROOT / job_id / RAW_SUBDIR_NAME
+    blob_refs = _parse_blob_refs(blobs)
+    overrides = {
+        "name": name.strip() if name and name.strip() else None,
+        "trigger": trigger.strip() if trigger and trigger.strip() else None,
+        "base_model": base_model,
+        "resolution": str(resolution) if resolution is not None else None,
+        "network_dim": str(network_dim) if network_dim is not None else None,
+        "steps": str(steps) if steps is not None else None,
+        "unet_only": unet_only,
+        "tagger": tagger.strip() if tagger else None,
+    }
+    # Claim the job before the first await so a concurrent retrain gets the 409 above
+    job = job_manager.restart(job_id, {k: v for k, v in overrides.items() if v is not None})
+    try:
+        await _store_uploads(files, raw_dir, job_id, blob_refs, offset=len(list(raw_dir.glob("*"))))
+    except Exception as exc:
+        job_manager.set_error(job_id, str(exc))
+        raise
+    job_manager.append_log(job_id, LOG_PIPELINE_RETRAIN)
+    job_manager.append_log(job_id, LOG_PIPELINE_FRAME_COUNT.format(count=len(list(raw_dir.glob("*")))))
+    asyncio.create_task(run_pipeline(job, raw_dir, config))
+
+    return {"job_id": job_id}
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str) -> Dict[str, object]:
+    """Remove a finished job's files and release its frames; unreferenced blobs are reclaimed."""
+    job = job_manager.get(job_id)
+    job_dir = JOBS_ROOT / job_id
+    if job_dir.resolve().parent != JOBS_ROOT.resolve() or (job is None and not job_dir.is_dir()):
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job and job.params.get("sweep_id"):
+        raise HTTPException(status_code=409, detail="Sweep jobs are managed through /sweeps")
+    if job and job.state not in (JobState.DONE, JobState.ERROR):
+        raise HTTPException(status_code=409, detail="Job is still running")
+    await backend.forget_dataset(job_dir / DATASET_SUBDIR_NAME)
+    shutil.rmtree(job_dir, ignore_errors=True)
+    blob_store.release(job_id)
+    job_manager.remove(job_id)
+    removed, reclaimed = blob_store.gc()
+    return {"job_id": job_id, "blobs_removed": removed, "bytes_reclaimed": reclaimed}
+
+
+@app.post("/blobs/check")
+async def check_blobs(hashes: str = Form(...)) -> Dict[str, object]:
+    """Report which sha256 digests (a JSON list) still need uploading."""
+    try:
+        digests = [check_digest(str(value)) for value in json.loads(hashes)]
+    except (TypeError, ValueError) as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from None
+    return {"missing": blob_store.missing(digests)}
+
+
+@app.post("/blobs")
+async def upload_blobs(files: List[UploadFile] = File(...)) -> Dict[str, object]:
+    stored = [{"sha256": blob_store.put(await file.read()), "filename": file.filename} for file in files]
+    return {"stored": stored}
+
+
 @app.get("/jobs/{job_id}/status")
 async def job_status(job_id: str) -> Dict[str, object]:
     job = job_manager.get(job_id)
@@ -112,6 +268,113 @@ async def job_status(job_id: str) -> Dict[str, object]:
     return job_manager.to_dict(job_id)
 
 
+@app.post("/sweeps")
+async def start_sweep(
+    name: str = Form(...),
+    trigger: str = Form(...),
+    base_model: str = Form(...),
+    resolution: int = Form(...),
+    unet_only: str = Form(...),
+    grid: str = Form(...),
+    files: List[UploadFile] = File([]),
+    blobs: Optional[str] = Form(None),
+    network_dim: Optional[int] = Form(None),
+    steps: Optional[int] = Form(None),
+    tagger: Optional[str] = Form(None),
+) -> Dict[str, object]:
+    """Prepare one dataset and train it once per point of ``grid`` (a JSON object of lists)."""
+    if not name.strip():
+        raise HTTPException(status_code=400, detail="Character name is required")
+    blob_refs = _parse_blob_refs(blobs)
+    if len(files) + len(blob_refs) < MIN_REFERENCE_IMAGES:
+        raise HTTPException(status_code=400, detail="At least 8 images required")
+    try:
+        runs = expand_grid(json.loads(grid))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from None
+
+    sweep_id = str(uuid4())
+    raw_dir = SWEEPS_ROOT / sweep_id / RAW_SUBDIR_NAME
+    raw_dir.mkdir(parents=True, exist_ok=True)
+    stored_files = await _store_uploads(files, raw_dir, sweep_id, blob_refs)
+
+    params: Dict[str, str] = {
+        "name": name.strip(),
+        "trigger": trigger.strip() or config.trigger_token,
+        "base_model": base_model,
+        "resolution": str(resolution),
+        "unet_only": str(unet_only),
+    }
+    if network_dim is not None:
+        params["network_dim"] = str(network_dim)
+    if steps is not None:
+        params["steps"] = str(steps)
+    if tagger:
+        params["tagger"] = tagger.strip()
+
+    sweep = sweep_manager.create(SweepRecord(sweep_id=sweep_id, params=params, runs=runs))
+    # The sweep id doubles as the job that prepares the shared dataset
+    bootstrap_job(raw_dir, {**params, "job_id": sweep_id, "sweep_id": sweep_id})
+    job_manager.append_log(sweep_id, LOG_PIPELINE_STARTED)
+    job_manager.append_log(sweep_id, LOG_PIPELINE_MODEL.format(base=base_model))
+    job_manager.append_log(sweep_id, LOG_PIPELINE_FRAME_COUNT.format(count=len(stored_files)))
+    asyncio.create_task(run_sweep(sweep, raw_dir, JOBS_ROOT, config))
+
+    return {"sweep_id": sweep_id, "runs": len(runs)}
+
+
+@app.get("/sweeps/{sweep_id}")
+async def sweep_status(sweep_id: str) -> Dict[str, object]:
+    if not sweep_manager.get(sweep_id):
+        raise HTTPException(status_code=404, detail="Sweep not found")
+    return sweep_manager.to_dict(sweep_id)
+
+
+@app.delete("/sweeps/{sweep_id}")
+async def delete_sweep(sweep_id: str) -> Dict[str, object]:
+    """Remove a finished sweep, its shared dataset and its runs; unreferenced blobs are reclaimed."""
+    sweep_dir = SWEEPS_ROOT / sweep_id
+    if sweep_dir.resolve().parent != SWEEPS_ROOT.resolve() or (
+        sweep_manager.get(sweep_id) is None and not sweep_dir.is_dir()
+    ):
+        raise HTTPException(status_code=404, detail="Sweep not found")
+    sweep = sweep_manager.get(sweep_id)
+    if sweep and sweep_manager.to_dict(sweep_id)["state"] not in (JobState.DONE.value, JobState.ERROR.value):
+        raise HTTPException(status_code=409, detail="Sweep is still running")
+    # Runs are named <sweep_id>-NN; globbing also finds them after a restart
+    runs = [*(sweep.job_ids if sweep else []), *(path.name for path in JOBS_ROOT.glob(f"{sweep_id}-*"))]
+    job_ids = [sweep_id, *dict.fromkeys(runs)]
+    # Runs train on the sweep's shared dataset, so that is the only staged copy
+    await backend.forget_dataset(sweep_dir / DATASET_SUBDIR_NAME)
+    shutil.rmtree(sweep_dir, ignore_errors=True)
+    for job_id in job_ids:
+        shutil.rmtree(JOBS_ROOT / job_id, ignore_errors=True)
+        blob_store.release(job_id)
+        job_manager.remove(job_id)
+    sweep_manager.remove(sweep_id)
+    removed, reclaimed = blob_store.gc()
+    return {
+        "sweep_id": sweep_id,
+        "jobs_removed": len(job_ids) - 1,
+        "blobs_removed": removed,
+        "bytes_reclaimed": reclaimed,
+    }
+
+
+@app.get("/resources/plan")
+async def resource_plan(resolution: Optional[int] = None, network_dim: Optional[int] = None) -> Dict[str, object]:
+    params = {
+        key: str(value)
+        for key, value in (("resolution", resolution), ("network_dim", network_dim))
+        if value is not None
+    }
+    try:
+        plan, cpu_threads = plan_job(params, config, config.max_concurrent_jobs, backend.capacity())
+    except RuntimeError as exc:
+        return {"ok": False, "error": str(exc)}
+    return {"ok": True, **plan.to_dict(), "cpu_threads": cpu_threads}
+
+
 @app.get("/gpu/diagnostics")
 async def gpu_diag() -> Dict[str, object]:
     return gpu_diagnostics()
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .constants import PACKED_IMAGES_NAME, PACKED_INDEX_NAME, PACKED_INDEX_VERSION
+
+# (digest, HxWx3 uint8 image, caption, source name)
+PackedItem = Tuple[str, np.ndarray, str, str]
+
+
+class PackedDataset:
+    """Read-only view of a packed dataset.
+
+    Images live in one memory-mapped ``uint8`` file of shape ``(count, res, res, 3)``;
+    indexing and slicing return views into the mapping, so nothing is copied until
+    the caller touches the pixels.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        index = json.loads((root / PACKED_INDEX_NAME).read_text(encoding="utf-8"))
+        if index.get("version") != PACKED_INDEX_VERSION:
+            raise ValueError(f"Unsupported packed dataset version in {root}")
+        self.resolution = int(index["resolution"])
+        self.items: List[Dict[str, Any]] = index["items"]
+        self._images: Optional[np.memmap] = None
+        if self.items:
+            self._images = np.memmap(
+                root / PACKED_IMAGES_NAME,
+                dtype=np.uint8,
+                mode="r",
+                shape=(len(self.items), self.resolution, self.resolution, 3),
+            )
+
+    @property
+    def images(self) -> np.ndarray:
+        if self._images is None:
+            return np.empty((0, self.resolution, self.resolution, 3), dtype=np.uint8)
+        return self._images
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, idx: int | slice) -> np.ndarray:
+        return self.images[idx]
+
+    def caption(self, idx: int) -> str:
+        return self.items[idx]["caption"]
+
+    def close(self) -> None:
+        # Views handed out earlier keep the mapping alive until they are released
+        self._images = None
+
+
+def open_packed(root: Path) -> Optional[PackedDataset]:
+    if not (root / PACKED_INDEX_NAME).exists():
+        return None
+    try:
+        return PackedDataset(root)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_index(root: Path, resolution: int, entries: List[Dict[str, Any]]) -> None:
+    tmp = root / f"{PACKED_INDEX_NAME}.tmp"
+    index = {"version": PACKED_INDEX_VERSION, "resolution": resolution, "dtype": "uint8", "items": entries}
+    tmp.write_text(json.dumps(index, indent=2, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(root / PACKED_INDEX_NAME)
+
+
+def write_packed(root: Path, resolution: int, items: Iterable[PackedItem], count: int) -> None:
+    """Write ``count`` items into ``root``, replacing any previous pack atomically."""
+    root.mkdir(parents=True, exist_ok=True)
+    row_bytes = resolution * resolution * 3
+    tmp = root / f"{PACKED_IMAGES_NAME}.tmp"
+    entries: List[Dict[str, Any]] = []
+    if count:
+        images = np.memmap(tmp, dtype=np.uint8, mode="w+", shape=(count, resolution, resolution, 3))
+        for row, (digest, image, caption, source) in enumerate(items):
+            images[row] = image
+            entries.append({"digest": digest, "caption": caption, "source": source, "offset": row * row_bytes})
+        images.flush()
+        del images
+        if len(entries) != count:
+            raise ValueError(f"Expected {count} packed items, got {len(entries)}")
+        os.replace(tmp, root / PACKED_IMAGES_NAME)
+    else:
+        (root / PACKED_IMAGES_NAME).unlink(missing_ok=True)
+    _write_index(root, resolution, entries)
+
+
+def update_captions(root: Path, captions: Dict[str, str]) -> None:
+    """Rewrite captions in the index only; the image file is left untouched."""
+    index = json.loads((root / PACKED_INDEX_NAME).read_text(encoding="utf-8"))
+    for entry in index["items"]:
+        entry["caption"] = captions.get(entry["digest"], entry["caption"])
+    _write_index(root, int(index["resolution"]), index["items"])
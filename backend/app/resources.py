@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Tuple
+
+from .config import AppConfig, ResourceConfig
+from .constants import (
+    GIB,
+    LOG_PIPELINE_MEMORY_LIMIT,
+    MEM_ACTIVATIONS_PER_SAMPLE_512,
+    MEM_BASE_MODEL_PARAMS,
+    MEM_LORA_PARAMS_PER_RANK,
+    MEM_OVERHEAD,
+    MEM_TRAINABLE_BYTES_PER_PARAM,
+)
+from .job_manager import job_manager
+
+try:
+    import torch  # type: ignore
+except Exception:  # pragma: no cover
+    torch = None  # type: ignore
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+@dataclass
+class ResourceCapacity:
+    device: str
+    memory_bytes: int
+    cpu_threads: int
+
+
+@dataclass
+class BatchPlan:
+    batch_size: int
+    grad_accum: int
+    effective_batch: int
+    estimate_bytes: int
+    budget_bytes: int
+    device: str
+    fits: bool = True
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "batch_size": self.batch_size,
+            "gradient_accumulation_steps": self.grad_accum,
+            "effective_batch": self.effective_batch,
+            "estimate_gib": round(self.estimate_bytes / GIB, 2),
+            "budget_gib": round(self.budget_bytes / GIB, 2),
+            "device": self.device,
+            "fits": self.fits,
+        }
+
+
+def _bytes_per_value(precision: str) -> int:
+    return 2 if precision in {"fp16", "bf16"} else 4
+
+
+def estimate_memory(resolution: int, network_dim: int, batch_size: int, precision: str) -> int:
+    """Rough peak memory of a kohya SD1.5 LoRA run, in bytes.
+
+    Frozen base weights at the compute precision, LoRA weights with fp32 grads and
+    AdamW state, and activations that scale with pixels per sample.
+    """
+    width = _bytes_per_value(precision)
+    frozen = MEM_BASE_MODEL_PARAMS * width
+    trainable = network_dim * MEM_LORA_PARAMS_PER_RANK * MEM_TRAINABLE_BYTES_PER_PARAM
+    per_sample = MEM_ACTIVATIONS_PER_SAMPLE_512 * (resolution / 512) ** 2 * width / 2
+    return int(frozen + trainable + per_sample * batch_size + MEM_OVERHEAD)
+
+
+def plan_batch(
+    effective_batch: int,
+    resolution: int,
+    network_dim: int,
+    precision: str,
+    capacity: ResourceCapacity,
+    safety_margin: float,
+    concurrent_jobs: int = 1,
+    adaptive: bool = True,
+    strict: bool = False,
+    max_effective_batch: int = 0,
+) -> BatchPlan:
+    """Largest micro-batch dividing ``effective_batch`` that fits this job's memory share.
+
+    Gradient accumulation makes up the rest, so the effective batch never changes, unless
+    ``max_effective_batch`` allows growing it: then the largest batch up to that limit that
+    fits without accumulation is used first. With ``adaptive`` off only the full batch is tried. When nothing fits the smallest
+    candidate is returned with ``fits`` unset (the estimate is rough), or, with
+    ``strict``, ``RuntimeError`` is raised before kohya gets the chance to run out of memory.
+    """
+    effective_batch = max(1, effective_batch)
+    budget = int(capacity.memory_bytes * safety_margin / max(1, concurrent_jobs))
+    if adaptive:
+        for batch in range(max_effective_batch, effective_batch, -1):
+            need = estimate_memory(resolution, network_dim, batch, precision)
+            if need <= budget:
+                return BatchPlan(
+                    batch_size=batch,
+                    grad_accum=1,
+                    effective_batch=batch,
+                    estimate_bytes=need,
+                    budget_bytes=budget,
+                    device=capacity.device,
+                )
+    divisors = [b for b in range(1, effective_batch + 1) if effective_batch % b == 0] if adaptive else [effective_batch]
+    for batch in reversed(divisors):
+        need = estimate_memory(resolution, network_dim, batch, precision)
+        if need <= budget:
+            return BatchPlan(
+                batch_size=batch,
+                grad_accum=effective_batch // batch,
+                effective_batch=effective_batch,
+                estimate_bytes=need,
+                budget_bytes=budget,
+                device=capacity.device,
+            )
+    need = estimate_memory(resolution, network_dim, divisors[0], precision)
+    if strict:
+        raise RuntimeError(
+            f"Not enough {capacity.device} memory: batch {divisors[0]} at {resolution}px, dim {network_dim} needs "
+            f"~{need / GIB:.1f} GiB but only {budget / GIB:.1f} GiB is available to this job"
+        )
+    return BatchPlan(
+        batch_size=divisors[0],
+        grad_accum=effective_batch // divisors[0],
+        effective_batch=effective_batch,
+        estimate_bytes=need,
+        budget_bytes=budget,
+        device=capacity.device,
+        fits=False,
+    )
+
+
+def _read_int(path: Path) -> Optional[int]:
+    try:
+        text = path.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return int(text) if text.isdigit() else None
+
+
+def _total_ram() -> int:
+    total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    # Containers: respect the cgroup limit (v2, then v1) when it is lower
+    for limit_path in (Path("/sys/fs/cgroup/memory.max"), Path("/sys/fs/cgroup/memory/memory.limit_in_bytes")):
+        limit = _read_int(limit_path)
+        if limit:
+            total = min(total, limit)
+    return total
+
+
+def _cpu_threads() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - non-Linux
+        return os.cpu_count() or 1
+
+
+def detect_ram(cfg: ResourceConfig) -> int:
+    """Host RAM (or ``simulate_ram_gb``), for CPU training."""
+    return int(cfg.simulate_ram_gb * GIB) if cfg.simulate_ram_gb is not None else _total_ram()
+
+
+def detect_capacity(cfg: ResourceConfig) -> ResourceCapacity:
+    """Total memory of the device kohya will train on, overridable for CPU-only testing."""
+    cpus = cfg.simulate_cpu_threads or _cpu_threads()
+    if cfg.simulate_vram_gb is not None:
+        return ResourceCapacity("cuda", int(cfg.simulate_vram_gb * GIB), cpus)
+    if cfg.simulate_ram_gb is not None:
+        return ResourceCapacity("cpu", detect_ram(cfg), cpus)
+    if torch is not None and torch.cuda.is_available():
+        return ResourceCapacity("cuda", int(torch.cuda.get_device_properties(0).total_memory), cpus)
+    return ResourceCapacity("cpu", detect_ram(cfg), cpus)
+
+
+def job_cpu_threads(cfg: ResourceConfig, capacity: ResourceCapacity, concurrent_jobs: int) -> int:
+    if cfg.cpu_threads:
+        return cfg.cpu_threads
+    return max(1, capacity.cpu_threads // max(1, concurrent_jobs))
+
+
+def job_memory_limit(cfg: ResourceConfig, concurrent_jobs: int) -> Optional[int]:
+    """Host memory cap for one trainer process tree; ``None`` disables the watchdog."""
+    if cfg.memory_limit_gb is not None:
+        return int(cfg.memory_limit_gb * GIB) if cfg.memory_limit_gb > 0 else None
+    return int(_total_ram() * cfg.safety_margin / max(1, concurrent_jobs))
+
+
+def plan_job(
+    params: Mapping[str, str],
+    config: AppConfig,
+    concurrent_jobs: int,
+    capacity: Optional[ResourceCapacity] = None,
+) -> Tuple[BatchPlan, int]:
+    """Pre-flight batch plan and CPU thread budget for one job's parameters on one node."""
+    capacity = capacity or detect_capacity(config.resources)
+    # Without a GPU kohya trains in fp32 (see training._build_training_command)
+    precision = config.train.mixed_precision if capacity.device == "cuda" else "no"
+    plan = plan_batch(
+        effective_batch=config.train.train_batch_size,
+        resolution=int(params.get("resolution", config.train.resolution)),
+        network_dim=int(params.get("network_dim", config.train.network_dim)),
+        precision=precision,
+        capacity=capacity,
+        safety_margin=config.resources.safety_margin,
+        concurrent_jobs=concurrent_jobs,
+        adaptive=config.resources.adaptive_batch,
+        strict=config.resources.strict_fit,
+        max_effective_batch=config.resources.max_effective_batch,
+    )
+    return plan, job_cpu_threads(config.resources, capacity, concurrent_jobs)
+
+
+def thread_env(threads: int) -> Dict[str, str]:
+    return {name: str(threads) for name in THREAD_ENV_VARS}
+
+
+def _process_memory(pid: int) -> int:
+    """Proportional set size: pages shared with forked workers are split between them, not counted per process."""
+    try:
+        text = Path(f"/proc/{pid}/smaps_rollup").read_text()
+    except FileNotFoundError:
+        # Kernels before 4.14: the same figures, one block per mapping
+        text = Path(f"/proc/{pid}/smaps").read_text()
+    return sum(int(line.split()[1]) for line in text.splitlines() if line.startswith("Pss:")) * 1024
+
+
+def _process_tree_memory(root_pid: int) -> int:
+    children: Dict[int, list] = {}
+    for stat_path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat_path.read_text().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat_path.parent.name))
+    total = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            total += _process_memory(pid)
+        except (OSError, IndexError, ValueError):
+            continue
+        pending.extend(children.get(pid, []))
+    return total
+
+
+class MemoryWatchdog:
+    """Kills the trainer when its process tree memory (PSS) goes over ``limit_bytes``.
+
+    The trainer must lead its own process group (``start_new_session``); the whole
+    group is killed, since ``accelerate launch`` does not take its workers down with it.
+    """
+
+    def __init__(self, process: asyncio.subprocess.Process, job_id: str, limit_bytes: int, interval: float = 1.0) -> None:
+        self.process = process
+        self.job_id = job_id
+        self.limit_bytes = limit_bytes
+        self.interval = interval
+        self.tripped = False
+        self.peak_bytes = 0
+
+    async def run(self) -> None:
+        while self.process.returncode is None:
+            used = await asyncio.to_thread(_process_tree_memory, self.process.pid)
+            self.peak_bytes = max(self.peak_bytes, used)
+            if used > self.limit_bytes:
+                self.tripped = True
+                job_manager.append_log(
+                    self.job_id,
+                    LOG_PIPELINE_MEMORY_LIMIT.format(used=used / GIB, limit=self.limit_bytes / GIB),
+                )
+                self._kill()
+                return
+            await asyncio.sleep(self.interval)
+
+    def _kill(self) -> None:
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            # Not a group leader after all: take down what we can
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
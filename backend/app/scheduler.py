@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Optional, Set
+
+from .constants import DEFAULT_MAX_CONCURRENT_JOBS, LOG_PIPELINE_QUEUED
+from .job_manager import JobState, job_manager
+
+
+class TrainingScheduler:
+    """Caps how many kohya_ss processes run at once; other jobs wait as ``queued``."""
+
+    def __init__(self, limit: int = DEFAULT_MAX_CONCURRENT_JOBS) -> None:
+        self._limit = max(1, limit)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._holders: Set[str] = set()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def configure(self, limit: int) -> None:
+        if self._holders:
+            raise RuntimeError("Cannot change the concurrency limit while jobs are training")
+        self._limit = max(1, limit)
+        self._semaphore = None
+
+    def _sem(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._limit)
+        return self._semaphore
+
+    async def acquire(self, job_id: str) -> None:
+        semaphore = self._sem()
+        if semaphore.locked():
+            job_manager.set_state(job_id, JobState.QUEUED)
+            job_manager.append_log(job_id, LOG_PIPELINE_QUEUED.format(limit=self._limit))
+        await semaphore.acquire()
+        self._holders.add(job_id)
+
+    def release(self, job_id: str) -> None:
+        # Safe to call for jobs that never got a slot
+        if job_id in self._holders:
+            self._holders.discard(job_id)
+            self._sem().release()
+
+
+scheduler = TrainingScheduler()
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from .config import AppConfig
+from .constants import (
+    LOG_PIPELINE_ERROR,
+    LOG_SWEEP_LAUNCH,
+    MAX_SWEEP_RUNS,
+    RAW_SUBDIR_NAME,
+    SWEEP_PARAM_TYPES,
+)
+from .job_manager import JobState, job_manager
+from .training import bootstrap_job, prepare_job_dataset, run_pipeline
+
+
+@dataclass
+class SweepRecord:
+    sweep_id: str
+    params: Dict[str, str]
+    runs: List[Dict[str, str]]
+    job_ids: List[str] = field(default_factory=list)
+
+
+def expand_grid(grid: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Turn ``{"network_dim": [16, 32], "steps": [1000]}`` into one override dict per run."""
+    if not isinstance(grid, dict) or not grid:
+        raise ValueError("Grid must be a non-empty object of parameter -> list of values")
+    unknown = sorted(set(grid) - set(SWEEP_PARAM_TYPES))
+    if unknown:
+        raise ValueError(f"Unsupported sweep parameters: {', '.join(unknown)}")
+    axes: List[List[str]] = []
+    for key, values in grid.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"Grid values for '{key}' must be a non-empty list")
+        try:
+            axes.append([str(SWEEP_PARAM_TYPES[key](v)) for v in values])
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value in grid for '{key}'") from None
+    runs = [dict(zip(grid, combo)) for combo in itertools.product(*axes)]
+    if len(runs) > MAX_SWEEP_RUNS:
+        raise ValueError(f"Grid expands to {len(runs)} runs; the limit is {MAX_SWEEP_RUNS}")
+    return runs
+
+
+class SweepManager:
+    def __init__(self) -> None:
+        self._sweeps: Dict[str, SweepRecord] = {}
+        self._lock = Lock()
+
+    def create(self, sweep: SweepRecord) -> SweepRecord:
+        with self._lock:
+            self._sweeps[sweep.sweep_id] = sweep
+        return sweep
+
+    def get(self, sweep_id: str) -> Optional[SweepRecord]:
+        with self._lock:
+            return self._sweeps.get(sweep_id)
+
+    def add_job(self, sweep_id: str, job_id: str) -> None:
+        with self._lock:
+            self._sweeps[sweep_id].job_ids.append(job_id)
+
+    def remove(self, sweep_id: str) -> None:
+        with self._lock:
+            self._sweeps.pop(sweep_id, None)
+
+    def to_dict(self, sweep_id: str) -> Dict[str, object]:
+        sweep = self.get(sweep_id)
+        if not sweep:
+            raise KeyError(sweep_id)
+        # The sweep's own job record carries the shared dataset preparation
+        prep = job_manager.get(sweep_id)
+        runs: List[Dict[str, object]] = []
+        for job_id, overrides in zip(list(sweep.job_ids), sweep.runs):
+            job = job_manager.get(job_id)
+            if not job:
+                continue
+            duration = None
+            if job.started_at is not None and job.finished_at is not None:
+                duration = round(job.finished_at - job.started_at, 1)
+            runs.append(
+                {
+                    "job_id": job_id,
+                    "params": overrides,
+                    "state": job.state.value,
+                    "final_loss": job.metrics.get("loss"),
+                    "duration_s": duration,
+                    "artifact_path": job.artifact_path,
+                    "error": job.error,
+                }
+            )
+
+        if prep is None or prep.state == JobState.ERROR:
+            state = JobState.ERROR.value
+        elif prep.state != JobState.DONE:
+            state = prep.state.value
+        elif len(runs) < len(sweep.runs) or any(r["state"] not in ("done", "error") for r in runs):
+            state = "running"
+        else:
+            state = JobState.DONE.value
+        finished = [r for r in runs if r["state"] == "done" and r["final_loss"] is not None]
+        best = min(finished, key=lambda r: r["final_loss"])["job_id"] if finished else None
+        return {
+            "sweep_id": sweep_id,
+            "state": state,
+            "logs": prep.logs if prep else [],
+            "error": prep.error if prep else None,
+            "runs": runs,
+            "best": best,
+        }
+
+
+sweep_manager = SweepManager()
+
+
+async def run_sweep(sweep: SweepRecord, raw_dir: Path, jobs_root: Path, config: AppConfig) -> None:
+    """Prepare the dataset once, then fan out one training job per grid point."""
+    sweep_id = sweep.sweep_id
+    try:
+        job_manager.set_state(sweep_id, JobState.PREPPING)
+        prep_job = job_manager.get(sweep_id)
+        dataset_dir = await asyncio.to_thread(prepare_job_dataset, prep_job, raw_dir, config)
+
+        job_manager.append_log(sweep_id, LOG_SWEEP_LAUNCH.format(count=len(sweep.runs)))
+        tasks = []
+        for idx, overrides in enumerate(sweep.runs):
+            job_id = f"{sweep_id}-{idx:02d}"
+            child_raw = jobs_root / job_id / RAW_SUBDIR_NAME
+            child_raw.parent.mkdir(parents=True, exist_ok=True)
+            params = {
+                **sweep.params,
+                **overrides,
+                "job_id": job_id,
+                "sweep_id": sweep_id,
+                "dataset_dir": str(dataset_dir),
+                "artifact_suffix": f"_sweep{idx:02d}",
+            }
+            child = bootstrap_job(child_raw, params)
+            sweep_manager.add_job(sweep_id, job_id)
+            tasks.append(asyncio.create_task(run_pipeline(child, child_raw, config)))
+        job_manager.set_state(sweep_id, JobState.DONE)
+        await asyncio.gather(*tasks)
+    except Exception as exc:  # pragma: no cover - defensive
+        job_manager.append_log(sweep_id, LOG_PIPELINE_ERROR.format(error=exc))
+        job_manager.set_error(sweep_id, str(exc))
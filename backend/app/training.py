@@ -1,12 +1,12 @@
 from __future__ import annotations
 
 import asyncio
+import re
 import shutil
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import os
 
-import torch
 
 from .config import AppConfig
 from .constants import (
@@ -14,30 +14,32 @@ from .constants import (
     CHECKPOINTS_SUBDIR_NAME,
     DATASET_CAPTIONS_SUBDIR,
     DATASET_IMAGES_SUBDIR,
+    DATASET_PACKED_SUBDIR,
     DATASET_SUBDIR_NAME,
+    GIB,
     LOG_PIPELINE_COPYING,
     LOG_PIPELINE_DONE,
     LOG_PIPELINE_ERROR,
+    LOG_PIPELINE_RESOURCE_OVERCOMMIT,
+    LOG_PIPELINE_RESOURCE_PLAN,
+    LOG_PIPELINE_SHARED_DATASET,
     LOG_PIPELINE_TRAINING_START,
 )
-from .dataset import prepare_dataset
+from .captioning import build_captioner
+from .dataset import export_kohya_layout, get_image_format, prepare_dataset
+from .executors import get_backend
 from .job_manager import JobState, JobRecord, job_manager
+from .log_pump import pump_stream
+from .resources import BatchPlan, MemoryWatchdog, job_memory_limit, plan_job, thread_env
+from .scheduler import scheduler
+
+_LOSS_RE = re.compile(r"loss\s*[:=]\s*([0-9]*\.?[0-9]+)", flags=re.IGNORECASE)
 
 
 async def _stream_process_output(process: asyncio.subprocess.Process, job_id: str, on_line: callable | None = None) -> None:
     if not process.stdout:
         return
-    while True:
-        line = await process.stdout.readline()
-        if not line:
-            break
-        text = line.decode("utf-8", errors="ignore").rstrip()
-        job_manager.append_log(job_id, text)
-        if on_line:
-            try:
-                on_line(text)
-            except Exception:
-                pass
+    await pump_stream(process.stdout, job_id, on_line=on_line)
 
 
 def _bool_param(value: str | bool, default: bool) -> bool:
@@ -51,7 +53,10 @@ def _bool_param(value: str | bool, default: bool) -> bool:
     return default
 
 
-def _prepare_dataset(job: JobRecord, raw_dir: Path, config: AppConfig) -> Path:
+def prepare_job_dataset(job: JobRecord, raw_dir: Path, config: AppConfig) -> Path:
+    """Prepare ``raw_dir`` into the ``dataset`` folder next to it and return that folder."""
+    if not get_image_format(config.dataset.image_format, config.dataset.image_level).kohya_readable:
+        raise ValueError(f"kohya_ss cannot train on '{config.dataset.image_format}' images; pick png, webp or jpeg")
     dataset_dir = raw_dir.parent / DATASET_SUBDIR_NAME
     prepare_dataset(
         job.job_id,
@@ -60,38 +65,56 @@ def _prepare_dataset(job: JobRecord, raw_dir: Path, config: AppConfig) -> Path:
         resolution=int(job.params.get("resolution", config.train.resolution)),
         trigger=job.params.get("trigger", config.trigger_token),
         name=job.params.get("name", "character"),
+        captioner=build_captioner(config.caption, job.params.get("tagger")),
+        image_format=config.dataset.image_format,
+        image_level=config.dataset.image_level,
+        packed=config.dataset.packed,
     )
     return dataset_dir
 
 
-def _build_training_command(
-    job: JobRecord,
-    dataset_dir: Path,
-    output_dir: Path,
-    config: AppConfig,
-) -> Tuple[List[str], str, Path]:
+def _prepare_dataset(job: JobRecord, raw_dir: Path, config: AppConfig) -> Path:
+    shared = job.params.get("dataset_dir")
+    if shared:
+        # Prepared once by a sweep; child runs only read it
+        dataset_dir = Path(shared)
+        if not dataset_dir.exists():
+            raise FileNotFoundError(f"Shared dataset not found: {dataset_dir}")
+        job_manager.append_log(job.job_id, LOG_PIPELINE_SHARED_DATASET.format(path=dataset_dir))
+    else:
+        dataset_dir = prepare_job_dataset(job, raw_dir, config)
+    return dataset_dir
+
+
+def _export_dataset(job: JobRecord, dataset_dir: Path, config: AppConfig) -> Path:
+    """The folder kohya_ss trains on: ``dataset_dir`` itself, or a folder export of its pack.
+
+    Called once the job holds a training slot, so queued jobs do not each keep a full image copy.
+    """
+    if not config.dataset.packed:
+        return dataset_dir
+    # kohya_ss only reads folders; materialize them off the job dir and drop them after training
+    export_dir = config.dataset.export_dir / job.job_id
+    shutil.rmtree(export_dir, ignore_errors=True)
+    return export_kohya_layout(
+        dataset_dir / DATASET_PACKED_SUBDIR,
+        export_dir,
+        job.params.get("name", "character").strip() or "concept",
+        image_format=config.dataset.image_format,
+        image_level=config.dataset.image_level,
+    )
+
+
+def _base_model(job: JobRecord, config: AppConfig) -> Tuple[str, Path]:
     base_key = job.params.get("base_model", config.base_model.use)
     base_path = config.base_model.paths.get(base_key)
     if not base_path:
         raise ValueError(f"Base model '{base_key}' not found in config")
-    if not base_path.exists():
-        raise FileNotFoundError(f"Base model file not found: {base_path}")
+    return base_key, base_path
 
-    if not config.kohya.script_path.exists():
-        raise FileNotFoundError(f"kohya_ss train_network.py script not found: {config.kohya.script_path}")
-
-    name = job.params.get("name", "character")
-    resolution = int(job.params.get("resolution", config.train.resolution))
-    steps = int(job.params.get("steps", config.train.steps))
-    network_dim = int(job.params.get("network_dim", config.train.network_dim))
-    unet_only = _bool_param(job.params.get("unet_only", config.train.unet_only), config.train.unet_only)
-    # Adjust mixed precision depending on device availability
-    mixed_precision = config.train.mixed_precision
-    use_cuda = torch.cuda.is_available()
-    if not use_cuda:
-        mixed_precision = "no"
 
-    # Ensure Accelerate config matches desired device
+def _write_accelerate_config(mixed_precision: str, use_cuda: bool) -> None:
+    """Ensure Accelerate config matches desired device"""
     try:
         accel_dir = Path("/root/.cache/huggingface/accelerate")
         accel_dir.mkdir(parents=True, exist_ok=True)
@@ -115,7 +138,46 @@ def _build_training_command(
     except Exception:
         pass
 
+
+def _build_training_command(
+    job: JobRecord,
+    dataset_dir: Path,
+    output_dir: Path,
+    config: AppConfig,
+    plan: Optional[BatchPlan] = None,
+    cpu_threads: int = 0,
+    use_cuda: bool = False,
+    local: bool = True,
+) -> Tuple[List[str], str, Path]:
+    """kohya_ss command line; paths are as the trainer sees them (remote for SSH nodes)."""
+    base_key, base_path = _base_model(job, config)
+    name = job.params.get("name", "character")
+    resolution = int(job.params.get("resolution", config.train.resolution))
+    steps = int(job.params.get("steps", config.train.steps))
+    network_dim = int(job.params.get("network_dim", config.train.network_dim))
+    learning_rate = float(job.params.get("learning_rate", config.train.lr_unet))
+    unet_only = _bool_param(job.params.get("unet_only", config.train.unet_only), config.train.unet_only)
+    # Adjust mixed precision depending on device availability
+    mixed_precision = config.train.mixed_precision
+    if not use_cuda:
+        mixed_precision = "no"
+
+    launch_options: List[str] = []
+    if local:
+        _write_accelerate_config(mixed_precision, use_cuda)
+    else:
+        # The config file above would land on the API host; pass the same settings as flags
+        launch_options = [
+            "--num_processes", "1",
+            "--num_machines", "1",
+            "--mixed_precision", mixed_precision,
+            "--dynamo_backend", "no",
+            *([] if use_cuda else ["--cpu"]),
+        ]
+
     artifact_stem = config.kohya.artifact_template.format(name=name, base=base_key)
+    # Sweep runs share a name and base model; keep their artifacts apart
+    artifact_stem += job.params.get("artifact_suffix", "")
     expected_artifact = output_dir / f"{artifact_stem}{ARTIFACT_SUFFIX}"
 
     images_dir = dataset_dir / DATASET_IMAGES_SUBDIR
@@ -123,6 +185,7 @@ def _build_training_command(
     command: List[str] = [
         config.kohya.accelerate_bin,
         "launch",
+        *launch_options,
         # If CUDA present, hint to use GPU id 0
         *(["--gpu_ids", "0"] if use_cuda else []),
         str(config.kohya.script_path),
@@ -145,9 +208,9 @@ def _build_training_command(
         "--save_every_n_steps",
         str(config.train.save_every),
         "--learning_rate",
-        str(config.train.lr_unet),
+        str(learning_rate),
         "--train_batch_size",
-        str(config.train.train_batch_size),
+        str(plan.batch_size if plan else config.train.train_batch_size),
         "--noise_offset",
         str(config.train.noise_offset),
         "--caption_dropout_rate",
@@ -160,6 +223,12 @@ def _build_training_command(
         ".txt",
     ]
 
+    if plan and plan.grad_accum > 1:
+        command.extend(["--gradient_accumulation_steps", str(plan.grad_accum)])
+    if cpu_threads:
+        # kohya defaults to 8 loader workers regardless of the box
+        command.extend(["--max_data_loader_n_workers", str(min(cpu_threads, 8))])
+
     if unet_only:
         command.append("--network_train_unet_only")
     elif config.train.lr_text > 0:
@@ -169,6 +238,8 @@ def _build_training_command(
 
 
 async def run_pipeline(job: JobRecord, raw_dir: Path, config: AppConfig) -> None:
+    backend = get_backend(config)
+    watch_task: Optional[asyncio.Task] = None
     try:
         # Try optional MLflow import
         mlflow = None
@@ -179,43 +250,88 @@ async def run_pipeline(job: JobRecord, raw_dir: Path, config: AppConfig) -> None
             mlflow = None
 
         job_manager.set_state(job.job_id, JobState.PREPPING)
-        dataset_dir = _prepare_dataset(job, raw_dir, config)
+        # Pre-flight: with resources.strict_fit, refuse jobs that cannot fit before spending time on the dataset
+        plan, cpu_threads = plan_job(job.params, config, config.max_concurrent_jobs, backend.capacity())
+        # Captioning and encoding are blocking; keep the event loop free for API requests
+        dataset_dir = await asyncio.to_thread(_prepare_dataset, job, raw_dir, config)
 
         output_subdir = config.kohya.output_subdir or CHECKPOINTS_SUBDIR_NAME
         output_dir = raw_dir.parent / output_subdir
         output_dir.mkdir(parents=True, exist_ok=True)
 
+        await scheduler.acquire(job.job_id)
         job_manager.set_state(job.job_id, JobState.TRAINING)
         job_manager.append_log(job.job_id, LOG_PIPELINE_TRAINING_START)
-
-        command, artifact_stem, expected_artifact = _build_training_command(job, dataset_dir, output_dir, config)
+        job_manager.append_log(
+            job.job_id,
+            LOG_PIPELINE_RESOURCE_PLAN.format(
+                batch=plan.batch_size,
+                accum=plan.grad_accum,
+                effective=plan.effective_batch,
+                need=plan.estimate_bytes / GIB,
+                budget=plan.budget_bytes / GIB,
+                device=plan.device,
+                threads=cpu_threads,
+            ),
+        )
+        if not plan.fits:
+            job_manager.append_log(
+                job.job_id,
+                LOG_PIPELINE_RESOURCE_OVERCOMMIT.format(
+                    batch=plan.batch_size,
+                    need=plan.estimate_bytes / GIB,
+                    budget=plan.budget_bytes / GIB,
+                    device=plan.device,
+                ),
+            )
 
         workspace = config.kohya.workspace if config.kohya.workspace else config.kohya.script_path.parent
-        if not workspace.exists():
-            raise FileNotFoundError(f"kohya_ss working directory not found: {workspace}")
+        await backend.check_paths(
+            job.job_id,
+            {
+                "Base model file": _base_model(job, config)[1],
+                "kohya_ss train_network.py script": config.kohya.script_path,
+                "kohya_ss working directory": workspace,
+            },
+        )
+        use_cuda = backend.use_cuda()
+        kohya_dataset_dir = await asyncio.to_thread(_export_dataset, job, dataset_dir, config)
+        train_dataset_dir, train_output_dir = await backend.stage(
+            job.job_id, kohya_dataset_dir, output_dir, source_dir=dataset_dir
+        )
+        command, artifact_stem, expected_artifact = _build_training_command(
+            job,
+            train_dataset_dir,
+            train_output_dir,
+            config,
+            plan=plan,
+            cpu_threads=cpu_threads,
+            use_cuda=use_cuda,
+            local=backend.local,
+        )
+        expected_artifact = output_dir / expected_artifact.name
 
+        # Keep BLAS/OpenMP pools within this job's share of the CPUs
+        env = thread_env(cpu_threads)
         # Propagate env with CUDA_VISIBLE_DEVICES if GPU available
-        env = os.environ.copy()
-        use_cuda_runtime = False
-        try:
-            use_cuda_runtime = bool(torch.cuda.is_available())
-        except Exception:
-            use_cuda_runtime = False
-        if use_cuda_runtime:
-            env["CUDA_VISIBLE_DEVICES"] = env.get("CUDA_VISIBLE_DEVICES", "0") or "0"
+        if use_cuda and backend.local:
+            env["CUDA_VISIBLE_DEVICES"] = os.environ.get("CUDA_VISIBLE_DEVICES", "0") or "0"
         # Collector for process logs (for MLflow artifact)
         collected: List[str] = []
 
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            cwd=str(workspace),
-            env=env,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-        )
+        process = await backend.launch(job.job_id, command, workspace, env)
+        watchdog = None
+        # Remote trainers are out of reach of the watchdog; only the ssh client runs here
+        memory_limit = job_memory_limit(config.resources, scheduler.limit) if backend.local else None
+        if memory_limit:
+            watchdog = MemoryWatchdog(process, job.job_id, memory_limit)
+            watch_task = asyncio.create_task(watchdog.run())
         # Optional line hook: parse simple progress or loss if present
         def _on_line(s: str) -> None:
             collected.append(s)
+            loss_match = _LOSS_RE.search(s) if "loss" in s.lower() else None
+            if loss_match:
+                job_manager.set_metric(job.job_id, "loss", float(loss_match.group(1)))
             if mlflow is None:
                 return
             # Very conservative parsing: log epoch increments as metric 'epoch_progress'
@@ -223,12 +339,9 @@ async def run_pipeline(job: JobRecord, raw_dir: Path, config: AppConfig) -> None
                 # Count occurrences as progress steps
                 mlflow.log_metric("epoch_progress", 1, step=len([x for x in collected if "epoch is incremented" in x.lower()]))
             # Optionally parse 'loss' tokens like 'loss: 0.1234'
-            if "loss" in s.lower():
+            if loss_match:
                 try:
-                    import re
-                    m = re.search(r"loss\s*[:=]\s*([0-9]*\.?[0-9]+)", s, flags=re.IGNORECASE)
-                    if m:
-                        mlflow.log_metric("loss", float(m.group(1)), step=len(collected))
+                    mlflow.log_metric("loss", float(loss_match.group(1)), step=len(collected))
                 except Exception:
                     pass
 
@@ -246,16 +359,22 @@ async def run_pipeline(job: JobRecord, raw_dir: Path, config: AppConfig) -> None
                     "resolution": job.params.get("resolution", config.train.resolution),
                     "network_dim": job.params.get("network_dim", config.train.network_dim),
                     "steps": job.params.get("steps", config.train.steps),
+                    "learning_rate": job.params.get("learning_rate", config.train.lr_unet),
                     "unet_only": job.params.get("unet_only", config.train.unet_only),
                     "mixed_precision": config.train.mixed_precision,
+                    "train_batch_size": plan.batch_size,
+                    "gradient_accumulation_steps": plan.grad_accum,
                 })
             except Exception:
                 run_ctx = None
 
         await _stream_process_output(process, job.job_id, on_line=_on_line)
         return_code = await process.wait()
+        if watchdog is not None and watchdog.tripped:
+            raise RuntimeError(f"kohya_ss exceeded the {memory_limit / GIB:.1f} GiB memory limit")
         if return_code != 0:
             raise RuntimeError(f"kohya_ss exited with code {return_code}")
+        await backend.collect(job.job_id, train_output_dir, output_dir)
 
         artifact_source = expected_artifact
         if not artifact_source.exists():
@@ -301,6 +420,14 @@ async def run_pipeline(job: JobRecord, raw_dir: Path, config: AppConfig) -> None
             _ml.set_tag("status", "error")
         except Exception:
             pass
+    finally:
+        if watch_task is not None:
+            watch_task.cancel()
+        if config.dataset.packed:
+            # The exported kohya folder is a full image copy; never leave it behind
+            shutil.rmtree(config.dataset.export_dir / job.job_id, ignore_errors=True)
+        await backend.release(job.job_id)
+        scheduler.release(job.job_id)
 
 
 def bootstrap_job(raw_dir: Path, params: Dict[str, str]) -> JobRecord:
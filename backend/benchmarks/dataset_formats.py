@@ -0,0 +1,105 @@
+"""Compare prepared-image formats: encode time, size on disk and trainer read time.
+
+Run from ``backend/``::
+
+    python -m benchmarks.dataset_formats --count 24 --resolution 512
+    python -m benchmarks.dataset_formats --images /path/to/reference/frames
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.dataset import IMAGE_FORMATS, ImageFormat
+
+# (format, level) pairs; None uses the format default
+CANDIDATES: List[Tuple[str, Optional[int]]] = [
+    ("png", 6),
+    ("png", 1),
+    ("png", 0),
+    ("webp", 0),
+    ("webp", 4),
+    ("jpeg", 95),
+    ("npy", None),
+]
+
+
+def _synthetic_images(count: int, resolution: int) -> List[Image.Image]:
+    # Smooth gradients plus sensor-like noise: compresses roughly like real photos
+    rng = np.random.default_rng(0)
+    ys, xs = np.mgrid[0:resolution, 0:resolution].astype(np.float32) / resolution
+    images = []
+    for _ in range(count):
+        phase = rng.uniform(0, 6.28, size=3)
+        base = np.stack([np.sin(xs * 6 + ys * 3 + p) for p in phase], axis=-1) * 90 + 128
+        noisy = base + rng.normal(0, 8, size=base.shape)
+        images.append(Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8), "RGB"))
+    return images
+
+
+def _load_images(folder: Path, resolution: int) -> List[Image.Image]:
+    images = []
+    for path in sorted(folder.iterdir()):
+        try:
+            with Image.open(path) as image:
+                images.append(image.convert("RGB").resize((resolution, resolution), Image.LANCZOS))
+        except OSError:
+            continue
+    return images
+
+
+def _bench(fmt: ImageFormat, level: Optional[int], images: List[Image.Image], epochs: int) -> Dict[str, object]:
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [Path(tmp) / f"{idx:03d}{fmt.suffix}" for idx in range(len(images))]
+        started = time.perf_counter()
+        for image, path in zip(images, paths):
+            fmt.save(image, path, level)
+        encode_s = time.perf_counter() - started
+        size = sum(path.stat().st_size for path in paths)
+        started = time.perf_counter()
+        for _ in range(epochs):
+            for path in paths:
+                fmt.load(path)
+        read_s = time.perf_counter() - started
+    count = len(images)
+    return {
+        "format": fmt.name,
+        "level": fmt.default_level if level is None else level,
+        "kohya_readable": fmt.kohya_readable,
+        "encode_ms_per_image": round(encode_s * 1000 / count, 2),
+        "mb_on_disk": round(size / 1e6, 2),
+        "read_ms_per_image": round(read_s * 1000 / (count * epochs), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=Path, help="folder of source images (default: synthetic)")
+    parser.add_argument("--count", type=int, default=24)
+    parser.add_argument("--resolution", type=int, default=512)
+    parser.add_argument("--epochs", type=int, default=3, help="full passes when timing reads")
+    parser.add_argument("--out", type=Path, help="also write the JSON results here")
+    args = parser.parse_args()
+
+    if args.images:
+        images = _load_images(args.images, args.resolution)
+    else:
+        images = _synthetic_images(args.count, args.resolution)
+    if not images:
+        parser.error("no images to benchmark")
+    results = [_bench(IMAGE_FORMATS[name], level, images, args.epochs) for name, level in CANDIDATES]
+    text = json.dumps(results, indent=2)
+    if args.out:
+        args.out.write_text(text, encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
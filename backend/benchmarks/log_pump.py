@@ -0,0 +1,87 @@
+"""Replay a recorded kohya_ss log through the legacy readline loop and the chunked pump.
+
+Run from ``backend/``::
+
+    python -m benchmarks.log_pump --repeat 50
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict
+
+from app.job_manager import JobRecord, job_manager
+from app.log_pump import pump_stream
+
+DEFAULT_LOG = Path(__file__).resolve().parent / "data" / "kohya_train_network.log"
+PIPE_WRITE_SIZE = 4096
+
+
+async def _legacy_pump(reader: asyncio.StreamReader, job_id: str) -> None:
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        job_manager.append_log(job_id, line.decode("utf-8", errors="ignore").rstrip())
+
+
+async def _chunked_pump(reader: asyncio.StreamReader, job_id: str) -> None:
+    await pump_stream(reader, job_id)
+
+
+async def _feed(reader: asyncio.StreamReader, payload: bytes) -> None:
+    # Mimic a fast writer: pipe-sized writes with no pacing beyond a scheduler yield
+    for offset in range(0, len(payload), PIPE_WRITE_SIZE):
+        reader.feed_data(payload[offset:offset + PIPE_WRITE_SIZE])
+        await asyncio.sleep(0)
+    reader.feed_eof()
+
+
+async def _run_one(
+    name: str,
+    consumer: Callable[[asyncio.StreamReader, str], Awaitable[None]],
+    payload: bytes,
+) -> Dict[str, object]:
+    job_id = f"bench-{name}"
+    job_manager.create_job(JobRecord(job_id=job_id))
+    reader = asyncio.StreamReader()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    await asyncio.gather(_feed(reader, payload), consumer(reader, job_id))
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    job = job_manager.get(job_id)
+    assert job is not None
+    raw_lines = payload.count(b"\n") + payload.count(b"\r")
+    return {
+        "pump": name,
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "input_mb": round(len(payload) / 1e6, 2),
+        "mb_per_s": round(len(payload) / 1e6 / wall, 1) if wall else None,
+        "raw_lines_per_s": round(raw_lines / wall) if wall else None,
+        "stored_log_entries": len(job.logs),
+        "stored_log_bytes": sum(len(s) for s in job.logs),
+        "progress": job.progress,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--log", type=Path, default=DEFAULT_LOG)
+    parser.add_argument("--repeat", type=int, default=50, help="times to replay the log back to back")
+    args = parser.parse_args()
+
+    payload = args.log.read_bytes() * args.repeat
+    results = [
+        asyncio.run(_run_one("readline", _legacy_pump, payload)),
+        asyncio.run(_run_one("chunked", _chunked_pump, payload)),
+    ]
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Packing throughput and random-access read latency: packed memmap vs PNG + .txt folder.
+
+Run from ``backend/``::
+
+    python -m benchmarks.packed_dataset --count 500 --resolution 512
+
+Pass ``--root`` to place the files on the disk under test (e.g. a Docker bind mount);
+the default is a temporary directory. Reads are warm-cache after the first pass.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from app.dataset import IMAGE_FORMATS, export_kohya_layout
+from app.packed_dataset import PackedDataset, write_packed
+
+from .dataset_formats import _synthetic_images
+
+
+def _latency_summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "p50_us": round(statistics.median(ordered) * 1e6, 1),
+        "p99_us": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6, 1),
+        "mean_us": round(statistics.fmean(ordered) * 1e6, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--resolution", type=int, default=512)
+    parser.add_argument("--reads", type=int, default=2000, help="random single-image reads per layout")
+    parser.add_argument("--root", type=Path, help="directory to benchmark in (default: temp dir)")
+    parser.add_argument("--out", type=Path, help="also write the JSON results here")
+    args = parser.parse_args()
+
+    # A handful of distinct frames repeated keeps synthetic generation cheap
+    frames = [np.asarray(image) for image in _synthetic_images(min(args.count, 16), args.resolution)]
+    arrays = [frames[idx % len(frames)] for idx in range(args.count)]
+    total_mb = args.count * args.resolution * args.resolution * 3 / 1e6
+
+    with tempfile.TemporaryDirectory(dir=args.root) as tmp:
+        root = Path(tmp)
+        packed_dir = root / "packed"
+        started = time.perf_counter()
+        write_packed(
+            packed_dir,
+            args.resolution,
+            ((f"{idx:016x}".ljust(64, "0"), image, f"svtchar item {idx}", f"{idx}.png") for idx, image in enumerate(arrays)),
+            count=args.count,
+        )
+        pack_s = time.perf_counter() - started
+
+        pack = PackedDataset(packed_dir)
+        started = time.perf_counter()
+        export_kohya_layout(packed_dir, root / "folder", "item", image_format="png")
+        export_s = time.perf_counter() - started
+        png = IMAGE_FORMATS["png"]
+        files = sorted((root / "folder").rglob("*.png"))
+
+        rng = random.Random(0)
+        order = [rng.randrange(args.count) for _ in range(args.reads)]
+        packed_lat: List[float] = []
+        for idx in order:
+            started = time.perf_counter()
+            np.array(pack[idx])  # copy forces the pages in
+            pack.caption(idx)
+            packed_lat.append(time.perf_counter() - started)
+        folder_lat: List[float] = []
+        for idx in order:
+            started = time.perf_counter()
+            png.load(files[idx])
+            files[idx].with_suffix(".txt").read_text(encoding="utf-8")
+            folder_lat.append(time.perf_counter() - started)
+        pack.close()
+
+    results = {
+        "count": args.count,
+        "resolution": args.resolution,
+        "packing": {
+            "seconds": round(pack_s, 3),
+            "images_per_s": round(args.count / pack_s, 1),
+            "mb_per_s": round(total_mb / pack_s, 1),
+        },
+        "export_png_folder": {
+            "seconds": round(export_s, 3),
+            "images_per_s": round(args.count / export_s, 1),
+        },
+        "random_read_packed": _latency_summary(packed_lat),
+        "random_read_png_folder": _latency_summary(folder_lat),
+    }
+    text = json.dumps(results, indent=2)
+    if args.out:
+        args.out.write_text(text, encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""End-to-end backend overhead: ``/train`` -> ``run_pipeline`` -> artifact, with a stub kohya_ss.
+
+Starts the API with uvicorn on a free local port, points kohya at
+``benchmarks/stub_kohya`` (no GPU, base model or kohya checkout needed) and submits
+``--jobs`` concurrent jobs while polling their status. Run from ``backend/``::
+
+    python -m benchmarks.pipeline --jobs 4 --images 12 --rate 20000
+    python -m benchmarks.pipeline --baseline benchmarks/results/pipeline-<previous>.json
+    python -m benchmarks.pipeline --ssh node1,node2 --ssh-stub   # SSH backend, loopback stand-in
+    python -m benchmarks.pipeline --ssh localhost                # SSH backend against a local sshd
+
+Results are printed and saved under ``benchmarks/results/`` for comparison between runs.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import re
+import resource
+import socket
+import statistics
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .dataset_formats import _synthetic_images
+
+BENCH_ROOT = Path(__file__).resolve().parent
+STUB_DIR = BENCH_ROOT / "stub_kohya"
+STUB_SSH_DIR = BENCH_ROOT / "stub_ssh"
+RESULTS_DIR = BENCH_ROOT / "results"
+DEFAULT_LOG = BENCH_ROOT / "data" / "kohya_train_network.log"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _multipart(fields: Dict[str, str], files: List[Tuple[str, bytes]]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for key, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode())
+    for filename, content in files:
+        body.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+            f"Content-Type: image/png\r\n\r\n".encode()
+        )
+        body.write(content)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+def _percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def _configure(workdir: Path, base_model: Path, ssh_hosts: Optional[List[str]] = None, ssh_stub: bool = False) -> Any:
+    """Point the imported API module at stub kohya and throwaway directories."""
+    import app.main as api
+    from app.blobstore import blob_store
+    from app.config import KohyaConfig, SSHConfig
+    from app.executors import configure_backend
+    from app.scheduler import scheduler
+
+    cfg = api.config
+    cfg.ed_lora_dir = workdir / "artifacts"
+    cfg.ed_lora_dir.mkdir(parents=True, exist_ok=True)
+    cfg.base_model.use = "bench"
+    cfg.base_model.paths = {"bench": base_model}
+    cfg.caption.cache_dir = workdir / "caption-cache"
+    cfg.dataset.export_dir = workdir / "exports"
+    # The stub needs no memory; pretend to have a GPU so the planner does not warn about the job
+    cfg.resources.simulate_vram_gb = 24.0
+    cfg.kohya = KohyaConfig(
+        accelerate_bin=str(STUB_DIR / "accelerate"),
+        script_path=STUB_DIR / "train_network.py",
+        workspace=STUB_DIR,
+        output_subdir="output",
+        network_module=cfg.kohya.network_module,
+        artifact_template=cfg.kohya.artifact_template,
+    )
+    api.JOBS_ROOT = workdir / "jobs"
+    api.JOBS_ROOT.mkdir(parents=True, exist_ok=True)
+    blob_store.configure(workdir / "blobs")
+    if ssh_hosts:
+        # The "remote" nodes are this machine either way, so the stub kohya paths stay valid.
+        # The workdir stays relative (the default) and is resolved against the node's home.
+        tools = {"ssh_bin": str(STUB_SSH_DIR / "ssh"), "rsync_bin": str(STUB_SSH_DIR / "rsync")} if ssh_stub else {}
+        cfg.ssh = SSHConfig(host=ssh_hosts[0], hosts=ssh_hosts[1:], use_cuda=False, memory_gb=24.0, **tools)
+        os.environ["STUB_SSH_ROOT"] = str(workdir / "remote")
+    api.backend = configure_backend(cfg)
+    scheduler.configure(cfg.max_concurrent_jobs * api.backend.nodes)
+    return api
+
+
+class _PumpTimer:
+    """Times the real log pump's work on each chunk, leaving out its waits on the (throttled) stub."""
+
+    def __init__(self) -> None:
+        self.busy: Dict[str, float] = {}
+
+    def wrap(self, pump: Callable[..., Awaitable[None]]) -> Callable[..., Awaitable[None]]:
+        async def timed(reader: Any, job_id: str, *args: Any, **kwargs: Any) -> None:
+            read = reader.read
+            returned: Optional[float] = None
+
+            async def timed_read(n: int = -1) -> bytes:
+                nonlocal returned
+                if returned is not None:
+                    # Nothing awaits between chunks, so this span is the pump's own work
+                    self.busy[job_id] = self.busy.get(job_id, 0.0) + time.perf_counter() - returned
+                chunk = await read(n)
+                returned = time.perf_counter()
+                return chunk
+
+            reader.read = timed_read
+            await pump(reader, job_id, *args, **kwargs)
+            if returned is not None:
+                self.busy[job_id] = self.busy.get(job_id, 0.0) + time.perf_counter() - returned
+
+        return timed
+
+
+class _Poller(threading.Thread):
+    """Polls one job's status, recording request latency and state transition times."""
+
+    def __init__(self, base_url: str, job_id: str, interval: float, started: float) -> None:
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.url = f"{base_url}/jobs/{job_id}/status"
+        self.interval = interval
+        self.started = started
+        self.latencies: List[float] = []
+        self.transitions: Dict[str, float] = {}
+        self.final: Dict[str, Any] = {}
+
+    def run(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            with urllib.request.urlopen(self.url) as resp:
+                status = json.loads(resp.read())
+            self.latencies.append(time.perf_counter() - t0)
+            self.transitions.setdefault(status["state"], time.perf_counter() - self.started)
+            if status["state"] in ("done", "error"):
+                self.final = status
+                return
+            time.sleep(self.interval)
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import uvicorn
+
+    from app import training
+    from app.constants import RAW_SUBDIR_NAME
+    from app.dataset import prepare_dataset
+    from app.job_manager import JobRecord, job_manager
+
+    os.environ["STUB_KOHYA_LOG"] = str(args.log)
+    os.environ["STUB_KOHYA_RATE"] = str(args.rate)
+    os.environ["STUB_KOHYA_REPEAT"] = str(args.repeat)
+
+    with tempfile.TemporaryDirectory(prefix="pipeline-bench-") as tmp:
+        workdir = Path(tmp)
+        os.environ.setdefault("MLFLOW_TRACKING_URI", (workdir / "mlruns").as_uri())
+        base_model = workdir / "base.safetensors"
+        base_model.write_bytes(b"\0" * 1024)
+        api = _configure(workdir, base_model, args.ssh.split(",") if args.ssh else None, args.ssh_stub)
+        pump_timer = _PumpTimer()
+        pump_stream = training.pump_stream
+        training.pump_stream = pump_timer.wrap(pump_stream)
+
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.01)
+        base_url = f"http://127.0.0.1:{port}"
+
+        uploads: List[List[Tuple[str, bytes]]] = []
+        for job in range(args.jobs):
+            files = []
+            for idx, image in enumerate(_synthetic_images(args.images, args.upload_size)):
+                # Vary one pixel per job so every upload is distinct content
+                image.putpixel((0, 0), (job % 256, idx % 256, 0))
+                buf = io.BytesIO()
+                image.save(buf, format="PNG")
+                files.append((f"frame_{idx:03d}.png", buf.getvalue()))
+            uploads.append(files)
+
+        fields = {
+            "name": "bench",
+            "trigger": "svtchar",
+            "base_model": "bench",
+            "resolution": str(args.resolution),
+            "network_dim": "8",
+            "steps": "240",
+            "unet_only": "true",
+        }
+        upload_times: List[float] = []
+        upload_bytes = 0
+        pollers: List[_Poller] = []
+        started = time.perf_counter()
+        for files in uploads:
+            body, content_type = _multipart(fields, files)
+            request = urllib.request.Request(f"{base_url}/train", data=body, headers={"Content-Type": content_type})
+            t0 = time.perf_counter()
+            with urllib.request.urlopen(request) as resp:
+                job_id = json.loads(resp.read())["job_id"]
+            upload_times.append(time.perf_counter() - t0)
+            upload_bytes += len(body)
+            poller = _Poller(base_url, job_id, args.poll_interval, started)
+            poller.start()
+            pollers.append(poller)
+        for poller in pollers:
+            poller.join()
+        wall = time.perf_counter() - started
+        server.should_exit = True
+        thread.join(timeout=5)
+        training.pump_stream = pump_stream
+
+        # Dataset prep in isolation, on the first job's uploaded frames
+        raw_dir = api.JOBS_ROOT / pollers[0].job_id / RAW_SUBDIR_NAME
+        job_manager.create_job(JobRecord(job_id="bench-prep"))
+        t0 = time.perf_counter()
+        prepare_dataset(
+            "bench-prep",
+            ((path, path.name) for path in sorted(raw_dir.glob("*"))),
+            workdir / "prep-only",
+            resolution=args.resolution,
+            trigger="svtchar",
+            name="bench",
+        )
+        prep_s = time.perf_counter() - t0
+
+    raw_segments = len(re.findall(rb"[\r\n]", args.log.read_bytes())) * args.repeat
+    pump_s = [pump_timer.busy[p.job_id] for p in pollers if pump_timer.busy.get(p.job_id)]
+    latencies = [lat for p in pollers for lat in p.latencies]
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items() if k not in {"out", "baseline"}},
+        "backend": f"{api.backend.name} x{api.backend.nodes}",
+        "jobs_ok": sum(1 for p in pollers if p.final.get("state") == "done"),
+        "errors": [p.final.get("error") for p in pollers if p.final.get("state") != "done"],
+        "wall_s": round(wall, 3),
+        "upload_mb_per_s": round(upload_bytes / 1e6 / sum(upload_times), 2),
+        "upload_ms_per_job": _percentiles(upload_times),
+        "prep_images_per_s": round(args.images / prep_s, 1),
+        # Segments of the replayed log over the pump's own processing time, whatever --rate is
+        "log_pump_lines_per_s": round(raw_segments / statistics.median(pump_s), 1) if pump_s else None,
+        "status_latency": _percentiles(latencies),
+        "status_requests": len(latencies),
+        # Backend process only; forked trainer children would report the parent's RSS at fork time
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    deltas: Dict[str, Any] = {}
+    for key, value in current.items():
+        if key == "params":
+            continue
+        old = baseline.get(key)
+        if isinstance(value, dict) and isinstance(old, dict):
+            nested = _compare(value, old)
+            if nested:
+                deltas[key] = nested
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            deltas[key] = f"{(value - old) / old:+.1%}"
+    return deltas
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=4, help="concurrent /train submissions")
+    parser.add_argument("--images", type=int, default=12, help="frames per job")
+    parser.add_argument("--upload-size", type=int, default=768, help="side of the uploaded frames in px")
+    parser.add_argument("--resolution", type=int, default=512)
+    parser.add_argument("--log", type=Path, default=DEFAULT_LOG, help="recorded kohya output to replay")
+    parser.add_argument("--rate", type=float, default=20000, help="stub output segments/sec, 0 = unthrottled")
+    parser.add_argument("--repeat", type=int, default=20, help="times the stub replays the log")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--ssh", help="comma-separated trainer nodes; runs jobs through the SSH backend")
+    parser.add_argument("--ssh-stub", action="store_true", help="use the loopback ssh/rsync stand-ins")
+    parser.add_argument("--out", type=Path, help="result file (default: benchmarks/results/pipeline-<time>.json)")
+    parser.add_argument("--baseline", type=Path, help="earlier result file to diff against")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.baseline:
+        results["vs_baseline"] = _compare(results, json.loads(args.baseline.read_text(encoding="utf-8")))
+    out = args.out or RESULTS_DIR / f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    text = json.dumps(results, indent=2)
+    out.write_text(text, encoding="utf-8")
+    print(text)
+    print(f"saved to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Stand-in for kohya_ss ``train_network.py`` used by the pipeline benchmark.
+
+Accepts the real command line, replays a recorded kohya log on stdout and writes a
+dummy ``.safetensors``. Tuned through the environment so the real command is unchanged:
+
+- ``STUB_KOHYA_LOG``: log to replay (default: ``benchmarks/data/kohya_train_network.log``)
+- ``STUB_KOHYA_RATE``: output segments (``\\r``/``\\n``-terminated) per second, 0 = unthrottled
+- ``STUB_KOHYA_REPEAT``: how many times to replay the log
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import struct
+import sys
+import time
+from pathlib import Path
+
+DEFAULT_LOG = Path(__file__).resolve().parents[1] / "data" / "kohya_train_network.log"
+TICK = 0.01
+
+
+def _write_safetensors(path: Path) -> None:
+    header = json.dumps({"__metadata__": {"format": "pt", "stub": "true"}}).encode("utf-8")
+    path.write_bytes(struct.pack("<Q", len(header)) + header)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train_data_dir", type=Path, required=True)
+    parser.add_argument("--output_dir", type=Path, required=True)
+    parser.add_argument("--output_name", required=True)
+    args, _ = parser.parse_known_args()
+
+    images = [p for p in args.train_data_dir.rglob("*") if p.suffix.lower() in {".png", ".jpg", ".webp"}]
+    if not images:
+        print(f"no images found in {args.train_data_dir}", flush=True)
+        return 1
+
+    payload = Path(os.environ.get("STUB_KOHYA_LOG", DEFAULT_LOG)).read_bytes()
+    segments = re.findall(rb"[^\r\n]*[\r\n]|[^\r\n]+$", payload) * int(os.environ.get("STUB_KOHYA_REPEAT", "1"))
+    rate = float(os.environ.get("STUB_KOHYA_RATE", "0"))
+    out = sys.stdout.buffer
+    if rate <= 0:
+        out.write(b"".join(segments))
+    else:
+        per_tick = max(1, int(rate * TICK))
+        started = time.perf_counter()
+        for offset in range(0, len(segments), per_tick):
+            out.write(b"".join(segments[offset:offset + per_tick]))
+            out.flush()
+            delay = started + (offset + per_tick) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    out.flush()
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    _write_safetensors(args.output_dir / f"{args.output_name}.safetensors")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
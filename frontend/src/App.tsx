@@ -2,6 +2,8 @@
 
 import {
   apiUrl,
+  API_BLOBS_CHECK_PATH,
+  API_BLOBS_PATH,
   API_CONFIG_TEST_PATH,
   API_JOBS_PATH,
   API_TRAIN_PATH,
@@ -24,7 +26,36 @@ import {
   resolveApiBase,
 } from "./constants_en";
 
-type JobState = "idle" | "prepping" | "training" | "copying" | "done" | "error";
+type JobState = "idle" | "prepping" | "queued" | "training" | "copying" | "done" | "error";
+
+async function sha256Hex(file: File): Promise<string> {
+  const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+}
+
+// Send hashes first and upload only frames the backend has not stored yet
+async function appendFrames(form: FormData, frames: File[]): Promise<void> {
+  if (!globalThis.crypto?.subtle) {
+    // WebCrypto needs a secure context; plain http off localhost uploads everything
+    frames.forEach((f) => form.append("files", f));
+    return;
+  }
+  const hashes = await Promise.all(frames.map(sha256Hex));
+  const check = new FormData();
+  check.append("hashes", JSON.stringify(hashes));
+  const res = await fetch(apiUrl(API_BLOBS_CHECK_PATH), { method: "POST", body: check });
+  if (!res.ok) throw new Error(`${API_BLOBS_CHECK_PATH} ${res.status}`);
+  const missing = new Set<string>((await res.json()).missing);
+  if (missing.size > 0) {
+    const upload = new FormData();
+    frames.forEach((f, i) => {
+      if (missing.delete(hashes[i])) upload.append("files", f);
+    });
+    const up = await fetch(apiUrl(API_BLOBS_PATH), { method: "POST", body: upload });
+    if (!up.ok) throw new Error(`${API_BLOBS_PATH} ${up.status}`);
+  }
+  form.append("blobs", JSON.stringify(frames.map((f, i) => ({ sha256: hashes[i], filename: f.name }))));
+}
 
 interface EnvInfo {
   ok: boolean;
@@ -65,7 +96,7 @@ export default function App(): JSX.Element {
   const [progress, setProgress] = useState<number>(0);
   const backendBase = useMemo(() => resolveApiBase().replace(/\/api$/, ""), []);
   const canStart = useMemo(
-    () => Boolean(name.trim()) && files.length >= MIN_REFERENCE_IMAGES && !["prepping", "training"].includes(state),
+    () => Boolean(name.trim()) && files.length >= MIN_REFERENCE_IMAGES && !["prepping", "queued", "training"].includes(state),
     [name, files, state]
   );
 
@@ -125,7 +156,6 @@ export default function App(): JSX.Element {
     if (files.length < MIN_REFERENCE_IMAGES) { setErrorMsg(ERROR_MIN_IMAGES); return; }
 
     const form = new FormData();
-    files.forEach((f) => form.append("files", f));
     form.append("name", name.trim());
     form.append("trigger", trigger.trim());
     form.append("base_model", baseModel);
@@ -137,6 +167,7 @@ export default function App(): JSX.Element {
     try {
       setState("prepping");
       pushLog(LOG_DATASET_PREP);
+      await appendFrames(form, files);
       const res = await fetch(apiUrl(API_TRAIN_PATH), { method: "POST", body: form });
       if (!res.ok) throw new Error(`/train ${res.status}`);
       const data: { job_id: string } = await res.json();
@@ -2,6 +2,8 @@ export const API_DEFAULT_PREFIX = "/api";
 export const API_CONFIG_TEST_PATH = "/config/test";
 export const API_TRAIN_PATH = "/train";
 export const API_JOBS_PATH = "/jobs";
+export const API_BLOBS_PATH = "/blobs";
+export const API_BLOBS_CHECK_PATH = "/blobs/check";
 
 export const DEFAULT_TRIGGER_TOKEN = "svtchar";
 export const DEFAULT_BASE_MODEL = "dreamshaper_8";